@@ -5,23 +5,35 @@
 
 from Tkinter import Tk, Canvas, Frame, BOTH, Listbox, Toplevel, Message, Button, Entry, Scrollbar, Scale, IntVar
 from Tkinter import N, S, W, E, NW, SW, NE, SE, CENTER, END, LEFT, RIGHT, X, Y, TOP, BOTTOM, HORIZONTAL
+from Tkinter import NORMAL, HIDDEN
 from PIL import Image
-from PIL import ImageDraw
-from PIL import ImageFont
 from PIL import ImageTk
 import sys
 import glob
-import copy
+import array
+import argparse
+import time
 import tkMessageBox
 import os
-import xml.etree.ElementTree as xml
+try:
+	import xml.etree.cElementTree as xml
+except ImportError:
+	import xml.etree.ElementTree as xml
 
-import matplotlib.image as mpimg
 import numpy as np
 
 from minimal_ctypes_opencv import *
 from config import cfg
 from config import cfg_from_file
+from framecache import FrameCache, ReadAhead
+from frameindex import FrameIndex, parseTimestamps, matchTimestamps
+from journal import Journal
+from annostore import AAStore, X1, Y1, X2, Y2, OBJECTID
+from hittest import GridIndex, ArrayIndex
+from tracking import NCCTracker, LKTracker, TMTracker, appearanceScore
+from depth import decodeDepthImage, prepareDepthLUTs, blendFrames
+from viewport import Viewport
+import parallel
 
 
 def mkdir_p(path):
@@ -45,8 +57,20 @@ CENTER_DIST_THR = 10
 CORNER_SIZE = 30
 CENTER_SIZE = 30
 JUMP_FRAMES = 25
+# Room left on the screen around the frame for the other widgets, when the
+# display scale fits the frames to the screen
+DISPLAY_MARGIN_X = 250
+DISPLAY_MARGIN_Y = 150
+# Zoom factor of a zoom step (mouse wheel, z and Z)
+ZOOM_STEP = 1.25
+BACKUP_XML = "save.xml"
+XML_BUFFER_SIZE = 1 << 20
+PARSE_PROGRESS = 100000
 
 TITLE = "Actanno V2.0"
+# Font of the object ids drawn on the rectangles (negative size: pixels)
+LABEL_FONT = ("Helvetica", -30)
+ANCHOR_SIZE = 5
 
 
 # ***************************************************************************
@@ -79,6 +103,16 @@ bindings="\
 			f : go to next frame + force propagation \n \
 			p : go to next frame + force propagation of rectangle with focus \n \
 			<Key-space> : go to next frame + propagation (no forcing)\n \
+			i : fill the frames between the boxes of each object by interpolation \n \
+		--------------------------------------------------------\n \
+		Display : \n \
+			b : show/hide the rgb and depth frames blended (or side by side) \n \
+			+ : more depth in the blended view \n \
+			- : less depth in the blended view \n \
+			z, <MouseWheel> up : zoom in at the mouse cursor \n \
+			Z, <MouseWheel> down : zoom out \n \
+			<Home> : show the whole frame \n \
+			<Button-2> drag : pan the zoomed view \n \
 		--------------------------------------------------------\n \
 		Deletion : \n \
 			d : delete rectangle with focus \n \
@@ -98,28 +132,34 @@ bindings="\
 
 
 
-def getSingleTag(tree, tagname):
+# Return the single tag tagname of tree. Errors are reported by
+# message(s), the message method of the controller.
+
+def getSingleTag(tree, tagname, message):
 	rv = tree.findall(tagname)
 	if len(rv) != 1:
-		tkMessageBox.showinfo(TITLE, "tag " + tagname + " needs to occur a single time at this point!")
+		message("tag " + tagname + " needs to occur a single time at this point!")
 		sys.exit(1)
 	return rv[0]
 
-# Return an attribute value. Check for its existence
+# Return an attribute value. Check for its existence, reporting a missing
+# one by message(s)
 
-def getAtt(node, attname):
+def getAtt(node, attname, message):
 	rv = node.get(attname)
 	if rv == None:
-		tkMessageBox.showinfo(TITLE, "attribute " + attname + " not found in tag " + node.tag)
+		message("attribute " + attname + " not found in tag " + node.tag)
 		sys.exit(1)
 	return rv
 
 # ***************************************************************************
 
 
-class AARect:
+class AARect(object):
 	"""A rectangle (bounding box) and its running id"""
 
+	__slots__ = ("x1", "y1", "x2", "y2", "objectId")
+
 	def __init__(self, x1, y1, x2, y2, objectId):
 		if x1 < x2:
 			self.x1 = x1
@@ -135,15 +175,39 @@ class AARect:
 			self.y2 = y1
 		self.objectId = objectId
 
+	# A copy of the rectangle, much cheaper than copy.deepcopy
+	def copy(self):
+		r = AARect.__new__(AARect)
+		r.x1 = self.x1
+		r.y1 = self.y1
+		r.x2 = self.x2
+		r.y2 = self.y2
+		r.objectId = self.objectId
+		return r
+
 	def show(self):
 		print "x1=", self.x1, "  y1=", self.y1, "  x2=", self.x2, "  y2=", self.y2, "  id=", self.objectId
 
+# Copy a list of rectangles
+def copyRects(rects):
+	return [r.copy() for r in rects]
+
 
 # ***************************************************************************
 # C type matching Python type
 class c_AARect(ctypes.Structure):
    	_fields_ = [("x1", ctypes.c_int),("y1", ctypes.c_int),("x2", ctypes.c_int),("y2", ctypes.c_int),("objectId", ctypes.c_int)]
 
+# ***************************************************************************
+# Index of the first rectangle of rects with the given (objectId, x1, y1, x2,
+# y2), see AAControler.logRect. Raise IndexError if there is none.
+def findRect(rects, box):
+	objectId, x1, y1, x2, y2 = box
+	for (i, r) in enumerate(rects):
+		if r.objectId == objectId and r.x1 == x1 and r.y1 == y1 and r.x2 == x2 and r.y2 == y2:
+			return i
+	raise IndexError("no rectangle %s" % (box,))
+
 # ***************************************************************************
 # convert AARect to c_AARect
 def to_c_AARect(r):
@@ -154,9 +218,114 @@ def to_c_AARect(r):
 def to_AARect(c_r):
 	return AARect(c_r.x1, c_r.y1, c_r.x2, c_r.y2, c_r.objectId)
 
+# ***************************************************************************
+# Read and decode an image file into a PIL image
+def decodeImageFile(path):
+	name,ext=os.path.splitext(path)
+	if ext == ".png":
+		img = decodeDepthImage(path, cfg.DEPTH_NEAR, cfg.DEPTH_FAR, cfg.DEPTH_COLORMAP)
+	elif ext == ".jpg":
+		img = Image.open(path)
+		img.load()
+	else:
+		print "def decodeImageFile(path): Extension not supported but trying anyway. [",ext,"]"
+		img = Image.open(path)
+		img.load()
+	return img
+
 
 # ***************************************************************************
-class SemMousePos:
+# Read and decode an image file into a PIL image scaled by the given factor.
+# JPEG files are decoded at a reduced size by the decoder (draft mode), to
+# the nearest size not smaller than the requested one, and then resized.
+def decodeDisplayFile(path, scale):
+	name,ext=os.path.splitext(path)
+	if ext == ".png":
+		img = decodeImageFile(path)
+		size = img.size
+	else:
+		img = Image.open(path)
+		size = img.size
+		if scale < 1:
+			img.draft(img.mode, (int(size[0]*scale), int(size[1]*scale)))
+		img.load()
+	size = (max(1, int(round(size[0]*scale))), max(1, int(round(size[1]*scale))))
+	if img.size != size:
+		img = img.resize(size, Image.BILINEAR)
+	return img
+
+
+# ***************************************************************************
+class JMTracker:
+	"""Tracking engine (see tracking.py) calling the JM tracking library"""
+
+	name = "JM"
+
+	def track(self, oldImage, newImage, rect):
+		return self.trackRects(oldImage, newImage, [rect])[0]
+
+	# The rectangles are passed to the library in a single call if it has
+	# the batch entry point, and one by one otherwise.
+	def trackRects(self, oldImage, newImage, rects):
+		n = len(rects)
+		if n < 1:
+			return []
+		# wrap the arrays into OpenCV images, without copying
+		cvOldImg = cvImageFromArray(oldImage, 0)
+		cvNewImg = cvImageFromArray(newImage, 1)
+
+		# convert Python types to C types
+		c_inrects = (c_AARect*n)(*[to_c_AARect(r) for r in rects])
+		c_outrects = (c_AARect*n)()
+
+		# call C++ tracking lib
+		try:
+			batch = trackingLib.track_block_matching_batch
+		except AttributeError:
+			batch = None
+		if batch != None:
+			batch(ctypes.byref(cvOldImg), ctypes.byref(cvNewImg), c_inrects, c_outrects, n)
+		else:
+			for i in range(n):
+				trackingLib.track_block_matching(ctypes.byref(cvOldImg), ctypes.byref(cvNewImg),
+					ctypes.byref(c_inrects[i]), ctypes.byref(c_outrects[i]))
+
+		# convert C types to Python types
+		return [to_AARect(c_r) for c_r in c_outrects]
+
+# ***************************************************************************
+# Tracking engines, created on first use and kept, since they may keep data
+# about the last frames
+trackers = {}
+
+# Return the tracking engine selected by the TRACKER option, or None if the
+# rectangles are simply copied
+def getTracker():
+	name = cfg.TRACKER
+	if name == "auto":
+		name = "jm" if trackingLib != None else "ncc"
+	if name not in trackers:
+		if name == "jm" and trackingLib != None:
+			trackers[name] = JMTracker()
+		elif name == "ncc":
+			trackers[name] = NCCTracker(cfg.TRACKER_SEARCH, cfg.TRACKER_LEVELS)
+		elif name in ("lk", "tm"):
+			try:
+				if name == "lk":
+					trackers[name] = LKTracker(cfg.TRACKER_FEATURES, cfg.TRACKER_LEVELS)
+				else:
+					trackers[name] = TMTracker(cfg.TRACKER_SEARCH, cfg.TRACKER_LEVELS)
+			except ImportError, e:
+				print name.upper(), "tracking not available:", e
+				print "using NCC tracking"
+				trackers[name] = NCCTracker(cfg.TRACKER_SEARCH, cfg.TRACKER_LEVELS)
+		else:
+			return None
+	return trackers[name]
+
+
+# ***************************************************************************
+class SemMousePos(object):
 	"""A semantic mouse position: in which rectangle (index) is the mouse
 	   and which semantic position does it occupy.
 	   sempose can be:
@@ -168,6 +337,8 @@ class SemMousePos:
 	   g	general position in the recangle
 	   n	no rectangles"""
 
+	__slots__ = ("index", "sempos")
+
 	def __init__(self, index, sempos):
 		self.index = index
 		self.sempos = sempos
@@ -175,20 +346,65 @@ class SemMousePos:
 # ***************************************************************************
 
 
-class AAFrame:
-	"""All rectangles of a frame"""
+class AAFrame(object):
+	"""All rectangles of a frame: a view on the boxes of frame nr in an
+	   AAStore. Without a store, the frame has a store of its own."""
 
-	def __init__(self):
-		self.rects = []
+	__slots__ = ("store", "nr")
+
+	def __init__(self, store=None, nr=0):
+		if store == None:
+			store = AAStore(1, AARect)
+		self.store = store
+		self.nr = nr
 
 	def getRects(self):
-		return self.rects
+		return self.store.frameRects(self.nr)
+
+	def setRects(self, rects):
+		self.store.setFrameRects(self.nr, rects)
+
+	rects = property(getRects, setRects)
 
 	# Check the position of the mouse cursor with respect to corners of all
 	# the rectangles, as well as the centers. If it is not near anything,
 	# still check for the nearest center.
+	# The search is done by scanning all rectangles, with a grid index or
+	# with NumPy arrays (see hittest.py), depending on the HIT_TEST option.
+	# The distance thresholds are in screen pixels: they are divided by the
+	# display scale of the frame.
+	def getSemMousePos(self, x, y, scale=1.):
+		if cfg.HIT_TEST == "grid":
+			return self.getSemMousePosGrid(x, y, scale)
+		if cfg.HIT_TEST == "numpy":
+			return self.getSemMousePosArray(x, y, scale)
+		return self.getSemMousePosScan(x, y, scale)
+
+	# Hit-testing with a grid index over the corners and centers
+	def getSemMousePosGrid(self, x, y, scale=1.):
+		return self.getSemMousePosIndexed(x, y, GridIndex, scale)
+
+	# Hit-testing with NumPy arrays of the corners and centers
+	def getSemMousePosArray(self, x, y, scale=1.):
+		return self.getSemMousePosIndexed(x, y, ArrayIndex, scale)
+
+	# Hit-testing with an index of the given class. The index is kept with
+	# the list of rectangles, and rebuilt when the list or the scale
+	# changed since it was built.
+	def getSemMousePosIndexed(self, x, y, indexClass, scale=1.):
+		rects = self.rects
+		cached = getattr(rects, "hitIndex", None)
+		if cached == None or cached[0] != rects.version or not isinstance(cached[1], indexClass) or cached[2] != scale:
+			cached = (rects.version, indexClass(rects, CORNER_DIST_THR/scale, CENTER_DIST_THR/scale), scale)
+			rects.hitIndex = cached
+		(index, sempos) = cached[1].query(x, y)
+		return SemMousePos(index, sempos)
+
+	# Hit-testing by scanning all rectangles
 	# position x,y
-	def getSemMousePos(self, x, y):
+	def getSemMousePosScan(self, x, y, scale=1.):
+		cornerThr = CORNER_DIST_THR/scale
+		centerThr = CENTER_DIST_THR/scale
 
 		# First check for the corners
 		minval = 99999999
@@ -216,7 +432,7 @@ class AAFrame:
 				argsem = "lr"
 
 		# We near enough to a corner, we are done
-		if minval < CORNER_DIST_THR * CORNER_DIST_THR:
+		if minval < cornerThr * cornerThr:
 			return SemMousePos(argindex, argsem)
 
 		# Now check for the nearest center
@@ -233,7 +449,7 @@ class AAFrame:
 		if argindex < 0:
 			return SemMousePos(-1, "n");
 
-		if minval < CENTER_DIST_THR * CENTER_DIST_THR:
+		if minval < centerThr * centerThr:
 			return SemMousePos(argindex, "c")
 		else:
 			return SemMousePos(argindex, "g")
@@ -243,7 +459,11 @@ class AAFrame:
 
 class AAControler:
 
-	def __init__(self):
+	# Messages go to dialog boxes, or to stderr when running without the GUI
+	interactive = True
+
+	def __init__(self, interactive=True):
+		self.interactive = interactive
 		# An array holding an AAFrame object for each frame of the video
 		self.frames = []
 		# An array holding the classnr for each object nr. ("objectId")
@@ -251,6 +471,20 @@ class AAControler:
 		# The nr. of the currently visible frame
 		self.curFrameNr = 0
 		self.switchActivated = False
+		# Blended view of the rgb and depth frames, see displayFrame()
+		self.blendActivated = False
+		self.blendAlpha = cfg.DEPTH_BLEND_ALPHA
+		# Size of the displayed frames relative to the files, see
+		# displayFrame(). Annotations stay in file coordinates.
+		self.displayScale = 1.
+		# Decoded frames, see curFrame()
+		self.frameCache = FrameCache(cfg.FRAME_CACHE_MB)
+		# Direction of travel through the video (+1 or -1), used to
+		# decode the next frames in advance
+		self.direction = 1
+		self.readAhead = None
+		if cfg.READ_AHEAD_THREADS > 0 and cfg.FRAME_CACHE_MB > 0:
+			self.readAhead = ReadAhead(self.frameCache, self.decodeKey, cfg.READ_AHEAD_THREADS)
 		#self.videoname = ""
 
 		if len(sys.argv) < 1:
@@ -266,52 +500,97 @@ class AAControler:
 		self.folderName = cfg.FOLDER_NAME
 		# voc path
 		self.vocPath =cfg.MAIN_DIR+cfg.VOC_DIR
-		# rgb
+		self.outputfilename=cfg.MAIN_DIR+cfg.XML_PREFIX
+		if not os.path.isdir(os.path.dirname(self.outputfilename)):
+			os.makedirs(os.path.dirname(self.outputfilename))
+
+		# frame lists, read from the index file if it is up to date
 		prefix=cfg.MAIN_DIR+cfg.RGB_PREFIX
-		self.filenames=sorted(glob.glob(prefix+"*"))
+		if not cfg.D_PREFIX=="default":
+			prefix_depth = cfg.MAIN_DIR+cfg.D_PREFIX
+		else:
+			prefix_depth = ""
+		indexfilename = os.path.splitext(self.outputfilename)[0]+".index.json"
+		# the backup and the journal of the unsaved changes are kept next to
+		# the XML file, so that each annotation has its own
+		self.backupfilename = os.path.splitext(self.outputfilename)[0]+"."+BACKUP_XML
+		self.journalfilename = os.path.splitext(self.outputfilename)[0]+"."+cfg.JOURNAL_FILE
+		index = None
+		if cfg.FRAME_INDEX:
+			index = FrameIndex.load(indexfilename, prefix, prefix_depth)
+		newIndex = index is None
+		if newIndex:
+			index = FrameIndex()
+			index.build(prefix, prefix_depth)
+		self.frameIndex = index
+
+		# rgb
+		self.filenames=index.filenames
 		if len(self.filenames)<1:
 			print >> sys.stderr, "Did not find any rgb frames! Is the prefix correct?"
 			self.usage()
+		# the boxes of all frames, see AAFrame
+		self.store = AAStore(len(self.filenames), AARect)
 		for i in range(len(self.filenames)):
-			self.frames.append(AAFrame())
+			self.frames.append(AAFrame(self.store, i))
 
 		# if depth
-		if not cfg.D_PREFIX=="default":
+		if prefix_depth:
 			print("USING RGB AND DEPTH")
 			self.depth_available = True
-			prefix_depth = cfg.MAIN_DIR+cfg.D_PREFIX
-			self.filenames_depth=sorted(glob.glob(prefix_depth+"*"))
+			prepareDepthLUTs(cfg.DEPTH_NEAR, cfg.DEPTH_FAR, cfg.DEPTH_COLORMAP)
+			self.filenames_depth=index.filenames_depth
 			if len(self.filenames_depth)<1:
 				print >> sys.stderr, "Did not find any depths frames! Is the prefix correct?"
 				self.usage()
 
-			self.array_rgb2depth_ts = np.zeros(len(self.filenames),dtype=np.int)
-			for id_img_rgb,filename_rgb in enumerate(self.filenames):
-				ts_rgb = int(filename_rgb.split("-")[-1].split(".")[0])
-				id_img_depth_closest = 0
-				ts_depth_closest = 0
-				for id_img_depth,filename_depth in enumerate(self.filenames_depth):
-					ts_depth = int(filename_depth.split("-")[-1].split(".")[0])
-					if abs(ts_rgb-ts_depth)<=abs(ts_rgb-ts_depth_closest):
-						ts_depth_closest = ts_depth
-						id_img_depth_closest = id_img_depth
-				self.array_rgb2depth_ts[id_img_rgb]=id_img_depth_closest
+			if newIndex:
+				index.timestamps = parseTimestamps(self.filenames)
+				index.timestamps_depth = parseTimestamps(self.filenames_depth)
+				index.rgb2depth, skews, mismatched = matchTimestamps(index.timestamps, index.timestamps_depth, cfg.DEPTH_MAX_SKEW)
+			else:
+				skews = np.abs(index.timestamps_depth[index.rgb2depth]-index.timestamps)
+				mismatched = skews > cfg.DEPTH_MAX_SKEW if cfg.DEPTH_MAX_SKEW >= 0 else np.zeros(len(skews), dtype=bool)
+			self.array_rgb2depth_ts = index.rgb2depth
+			if mismatched.any():
+				print >> sys.stderr, np.count_nonzero(mismatched), "rgb frame(s) have no depth frame within", cfg.DEPTH_MAX_SKEW, ":"
+				for i in np.flatnonzero(mismatched):
+					print >> sys.stderr, "  ", self.filenames[i], "->", self.filenames_depth[self.array_rgb2depth_ts[i]], "(skew", skews[i], ")"
 			# print self.array_rgb2depth_ts
 		else:
 			print("USING RGB ONLY")
 			self.depth_available = False
-			prefix_depth = ""
-
-		self.outputfilename=cfg.MAIN_DIR+cfg.XML_PREFIX
-		# If the given XML file exists, parse it
 
-		if not os.path.isdir(os.path.dirname(self.outputfilename)):
-			os.makedirs(os.path.dirname(self.outputfilename))
+		if newIndex and cfg.FRAME_INDEX:
+			try:
+				index.save(indexfilename)
+			except IOError:
+				print >> sys.stderr, "Could not write the frame index", indexfilename
+
+		# Changes since the last save are logged to a journal
+		self.journal = None
+		journal = Journal(self.journalfilename, os.path.abspath(self.outputfilename))
+		self.recovered = False
+
+		# Without the GUI, unsaved changes cannot be offered for recovery;
+		# leave them to the next GUI session rather than overwriting them
+		if journal.pending() and os.path.isfile(self.backupfilename) and not interactive:
+			self.message("The annotation was not saved when actanno was last closed. Open it in actanno to recover or discard the unsaved changes first.")
+			sys.exit(1)
 
-		if os.path.isfile(self.outputfilename):
+		# If the given XML file exists, parse it
+		if journal.pending() and os.path.isfile(self.backupfilename) and \
+			tkMessageBox.askyesno(TITLE, "The annotation was not saved when actanno was last closed. Recover the unsaved changes?"):
+			self.parseXML(self.backupfilename)
+			self.replayJournal(journal)
+			journal.resume()
+			self.recovered = True
+		elif os.path.isfile(self.outputfilename):
+			journal.remove()
 			if os.stat(self.outputfilename).st_size>0:
 				self.parseXML()
 		else:
+			journal.remove()
 			# If it does NOT exist, let's try to create one
 			try:
 				fd=open(self.outputfilename,'w')
@@ -319,9 +598,18 @@ class AAControler:
 			# Unsuccessful -> the given directory does not exist
 			except:
 				s="Could not save to the specified XML file. Please check the location. Does the directory exist?"
-				tkMessageBox.showinfo(TITLE,s)
+				self.message(s)
 				sys.exit(1)
-			tkMessageBox.showinfo(TITLE, "XML File "+self.outputfilename+" does not exist. Creating a new one.")
+			self.message("XML File "+self.outputfilename+" does not exist. Creating a new one.")
+		# without the GUI, the annotation is saved once at the end
+		if interactive:
+			self.journal = journal
+
+	def message(self, s):
+		if self.interactive:
+			tkMessageBox.showinfo(TITLE, s)
+		else:
+			print >> sys.stderr, s
 
 	def usage(self):
 		print >> sys.stderr, "usage:"
@@ -344,8 +632,9 @@ class AAControler:
 		#		acts[r.objectId] = frnr;
 
 		# Check for several occurrences of a objectId in the same frame.
-		for (frnr,fr) in enumerate(self.frames):
-			msg=msg+self.checkValidityFrame(frnr)
+		data, framecol = self.store.columns()
+		for row in self.store.duplicates():
+			msg = msg+'Activity nr. '+str(data[row,OBJECTID])+' occurs multiple times in frame nr. '+str(framecol[row]+1)+'.\n'
 
 		# Check for unassigned ClassAssignations (no known object class)
 		msg2=''
@@ -370,50 +659,153 @@ class AAControler:
 		return msg
 
 	# Open the image corresponding to the current frame number,
-	# set the property self.curImage, and return it
+	# set the property self.curImage, and return it.
+	# Decoded frames are kept in an LRU cache keyed by (path, mode).
+	# If the frames are displayed at a reduced size, only the displayed
+	# frame is decoded, curImage is None and the full frame is decoded
+	# when the tracking code asks for it (see frameArray).
 	def curFrame(self):
 		if self.switchActivated and self.depth_available:
 			# find the depth image whose timestamp is the closer from the rgb image
-			# print "using depth images"
-			name,ext=os.path.splitext(self.filenames_depth[self.array_rgb2depth_ts[self.curFrameNr]])
 			path = self.filenames_depth[self.array_rgb2depth_ts[self.curFrameNr]]
+			mode = "depth"
 		else:
-			# print "using rgb images"
-			name,ext=os.path.splitext(self.filenames[self.curFrameNr])
 			path = self.filenames[self.curFrameNr]
-		# print name
-		if ext == ".png":
-			# png = Image.open(self.filenames[self.curFrameNr])#.convert('L')
-			img_matplotlib=mpimg.imread(path)
-			value_max = np.amax(img_matplotlib)
-			scale = 254. / value_max
-			png = Image.fromarray(np.uint8((img_matplotlib)*scale))
-			# print(40*"-")
-			# print "format :",png.format
-			# print "size :", png.size
-			# print "mode :", png.mode
-			# png.load()
-			data = list(png.getdata())
-			# print "max(data)", max(data),"min(data)", min(data)
-			self.curImage = png.convert('RGB')
-		elif ext == ".jpg":
-				self.curImage = Image.open(self.filenames[self.curFrameNr])
+			mode = "rgb"
+		key = (path, mode)
+		self.curKey = key
+		if self.displayScale == 1:
+			self.curImage = self.cachedFrame(key)
 		else:
-			print "def curFrame(self): Extension not supported but trying anyway. [",ext,"]"
-			self.curImage = Image.open(self.filenames[self.curFrameNr])
-		   	# print "frame nr. ",self.curFrameNr, "=",self.filenames[self.curFrameNr]
+			self.curImage = None
+		self.readAheadFrames()
 		return self.curImage
 
+	# Return the decoded frame of the cache key (path, mode), from the cache
+	# if possible
+	def cachedFrame(self, key):
+		if self.readAhead != None:
+			self.readAhead.wait(key)
+		img = self.frameCache.get(key)
+		if img is None:
+			img = self.decodeKey(key)
+			self.frameCache.put(key, img)
+		return img
+
+	# Cache key of the displayed version of the frame of the given key
+	def displayKey(self, key):
+		if self.displayScale == 1:
+			return key
+		return (key[0], key[1]+"-display")
+
+	# Decode the frame of a cache key: modes ending in "-display" are
+	# decoded at the display scale
+	def decodeKey(self, key):
+		if key[1].endswith("-display"):
+			return decodeDisplayFile(key[0], self.displayScale)
+		return self.decodeFrame(key[0])
+
+	# Size of the frames in their files, read from the header of the first
+	# one
+	def frameSize(self):
+		return Image.open(self.filenames[0]).size
+
+	# Return the image shown for the current frame (after curFrame), at
+	# the display scale: the current frame, or in the blended view the rgb
+	# frame and its matched depth frame mixed with the weight blendAlpha of
+	# the depth (DEPTH_BLEND "alpha") or next to each other (DEPTH_BLEND
+	# "side"). Both frames come from the cache, as arrays, so that toggling
+	# the view or changing the mix does not decode anything.
+	def displayFrame(self):
+		return self.viewFrame()[1]
+
+	# Return (key, image) for the image of displayFrame, at the display
+	# scale or, if full is set, at the size of the files. key identifies the
+	# content of the image in the frame cache.
+	def viewFrame(self, full=False):
+		if full:
+			keyOf = lambda key: key
+		else:
+			keyOf = self.displayKey
+		if not (self.blendActivated and self.depth_available):
+			if self.curImage is not None:
+				return (self.curKey, self.curImage)
+			key = keyOf(self.curKey)
+			return (key, self.cachedFrame(key))
+		rgbKey = keyOf((self.filenames[self.curFrameNr], "rgb"))
+		depthKey = keyOf((self.filenames_depth[self.array_rgb2depth_ts[self.curFrameNr]], "depth"))
+		key = (rgbKey[0], "%s-%s-%d" % (rgbKey[1], cfg.DEPTH_BLEND, int(round(256*self.blendAlpha))))
+		blend = self.frameCache.get(key)
+		if blend is not None:
+			return (key, blend)
+		rgbImg = self.cachedFrame(rgbKey)
+		depthImg = self.cachedFrame(depthKey)
+		if depthImg.size != rgbImg.size:
+			# the depth frame resized once to the rgb frame
+			depthKey = (depthKey[0], "depth-%dx%d" % rgbImg.size)
+			img = self.frameCache.get(depthKey)
+			if img is None:
+				img = depthImg.resize(rgbImg.size, Image.NEAREST)
+				self.frameCache.put(depthKey, img)
+			depthImg = img
+		rgb = self.frameArray(rgbKey, rgbImg)
+		depth = self.frameArray(depthKey, depthImg)
+		if cfg.DEPTH_BLEND == "side":
+			blend = Image.fromarray(np.hstack((rgb, depth)))
+		else:
+			blend = Image.fromarray(blendFrames(rgb, depth, self.blendAlpha))
+		self.frameCache.put(key, blend)
+		return (key, blend)
+
+	# Return the pixels of the frame image img, decoded from the file of the
+	# given cache key, as a contiguous numpy array for the tracking code.
+	# The array is cached next to the image, so that a frame propagated to
+	# the next one is converted only once. If img is None, the frame is
+	# taken from the cache or decoded.
+	def frameArray(self, key, img=None):
+		arrayKey = (key[0], key[1]+"-array")
+		arr = self.frameCache.get(arrayKey)
+		if arr is None:
+			if img is None:
+				img = self.cachedFrame(key)
+			arr = np.ascontiguousarray(np.asarray(img))
+			self.frameCache.put(arrayKey, arr)
+		return arr
+
+	# Ask the read-ahead threads to decode the next frames in the current
+	# direction of travel, together with their matched depth frames, at
+	# the display scale
+	def readAheadFrames(self):
+		if self.readAhead == None:
+			return
+		keys = []
+		for i in range(1, cfg.READ_AHEAD_FRAMES+1):
+			nr = self.curFrameNr + i*self.direction
+			if nr < 0 or nr >= len(self.filenames):
+				break
+			keys.append(self.displayKey((self.filenames[nr], "rgb")))
+			if self.depth_available:
+				path = self.filenames_depth[self.array_rgb2depth_ts[nr]]
+				keys.append(self.displayKey((path, "depth")))
+		self.readAhead.schedule(keys)
+
+	# Read and decode an image file into a PIL image
+	def decodeFrame(self, path):
+		return decodeImageFile(path)
+
 	# Remove all rectangles of the current frame
 	def deleteAllRects(self):
+		self.log("clear", self.curFrameNr)
 		self.frames[self.curFrameNr].rects = []
 
 	# Remove the rectangle with the given index from the list
 	# of rectangles of the currently selected frame
 	def deleteRect(self, index):
+		self.logRect("del", self.curFrameNr, index)
 		del self.frames[self.curFrameNr].rects[index];
 
 	def nextFrame(self,doPropagate,force):
+		self.direction = 1
 		if self.curFrameNr<len(self.filenames)-1:
 			self.curFrameNr+=1
 		# if the next frame does NOT contain any rectangles,
@@ -425,38 +817,31 @@ class AAControler:
 			if x>0 and not force :
 				print "No propagation, target frame is not empty"
 			else:
+				self.log("clear", self.curFrameNr)
 				self.frames[self.curFrameNr].rects = []
 				y = len(self.frames[self.curFrameNr-1].rects)
 				if y>0:
 					# Tracking code goes here .....
 					print "Propagating ",y,"rectangle(s) to next frame"
 
-					if trackingLib == None:
+					tracker = getTracker()
+					if tracker == None:
 						# simple copy
 						print "simple copy"
 						self.curFrame()
-						self.frames[self.curFrameNr].rects = copy.deepcopy(self.frames[self.curFrameNr-1].rects)
+						self.frames[self.curFrameNr].rects = copyRects(self.frames[self.curFrameNr-1].rects)
+						for r in self.frames[self.curFrameNr].rects:
+							self.log("add", self.curFrameNr, r.x1, r.y1, r.x2, r.y2, r.objectId)
 					else:
-						# JM tracking
-						print "use JM tracking"
+						print "use", tracker.name, "tracking"
 						self.oldFrame = self.curImage
+						oldKey = self.curKey
 						self.curFrame()
 
-						for inrect in self.frames[self.curFrameNr-1].rects:
-							# convert PIL image to OpenCV image
-							cvOldImg = cvCreateImageFromPilImage(self.oldFrame)
-							cvCurImg = cvCreateImageFromPilImage(self.curImage)
-							# No need to invoke cvRelease...()
-
-							# convert Python types to C types
-							c_inrect = to_c_AARect(inrect)
-							c_outrect = c_AARect()
-
-							# call C++ tracking lib
-							trackingLib.track_block_matching( ctypes.byref(cvOldImg), ctypes.byref(cvCurImg), ctypes.byref(c_inrect), ctypes.byref(c_outrect))
-
-							# convert C types to Python types
-							outrect = to_AARect(c_outrect)
+						oldArray = self.frameArray(oldKey, self.oldFrame)
+						curArray = self.frameArray(self.curKey, self.curImage)
+						for outrect in tracker.trackRects(oldArray, curArray, self.frames[self.curFrameNr-1].rects):
+							self.log("add", self.curFrameNr, outrect.x1, outrect.y1, outrect.x2, outrect.y2, outrect.objectId)
 							self.frames[self.curFrameNr].rects.append(outrect)
 
 				else:
@@ -464,12 +849,12 @@ class AAControler:
 
 		else:
 			self.curFrame()
-		self.exportXMLFilename("save.xml")
 		return self.curImage
 
 	def nextFramePropCurrentRect(self,rect_index):
 		propagateId = self.frames[self.curFrameNr].rects[rect_index].objectId
 		print "Rect[",rect_index,"].objectId == ",  propagateId
+		self.direction = 1
 
 		if self.curFrameNr<len(self.filenames)-1:
 			self.curFrameNr+=1
@@ -485,32 +870,20 @@ class AAControler:
 			rectToPropagate = self.frames[self.curFrameNr-1].rects[rect_index]
 
 			# get his new position by tracking
-			if trackingLib == None:
+			tracker = getTracker()
+			if tracker == None:
 				# simple copy
 				print "simple copy"
 				self.curFrame()
-				rectPropagated = copy.deepcopy(rectToPropagate)
+				rectPropagated = rectToPropagate.copy()
 			else:
-				# JM tracking
-				print "use JM tracking"
+				print "use", tracker.name, "tracking"
 				self.oldFrame = self.curImage
+				oldKey = self.curKey
 				self.curFrame()
-
-
-				# convert PIL image to OpenCV image
-				cvOldImg = cvCreateImageFromPilImage(self.oldFrame)
-				cvCurImg = cvCreateImageFromPilImage(self.curImage)
-				# No need to invoke cvRelease...()
-
-				# convert Python types to C types
-				c_inrect = to_c_AARect(rectToPropagate)
-				c_outrect = c_AARect()
-
-				# call C++ tracking lib
-				trackingLib.track_block_matching( ctypes.byref(cvOldImg), ctypes.byref(cvCurImg), ctypes.byref(c_inrect), ctypes.byref(c_outrect))
-
-				# convert C types to Python types
-				rectPropagated = to_AARect(c_outrect)
+				oldArray = self.frameArray(oldKey, self.oldFrame)
+				curArray = self.frameArray(self.curKey, self.curImage)
+				rectPropagated = tracker.track(oldArray, curArray, rectToPropagate)
 				# self.frames[self.curFrameNr].rects.append(outrect)
 
 			rectPropagated.objectId = propagateId
@@ -520,42 +893,188 @@ class AAControler:
 			for i,currentrect in enumerate(self.frames[self.curFrameNr].rects):
 				if currentrect.objectId == propagateId:
 					print "Rectangle found. Updating."
-					self.frames[self.curFrameNr].rects[i] = copy.deepcopy(rectPropagated)
+					self.logRect("move", self.curFrameNr, i, rectPropagated.x1, rectPropagated.y1, rectPropagated.x2, rectPropagated.y2)
+					self.frames[self.curFrameNr].rects[i] = rectPropagated.copy()
 					rectAlreadyExists = True
 					break
 
 			if not rectAlreadyExists:
+				self.log("add", self.curFrameNr, rectPropagated.x1, rectPropagated.y1, rectPropagated.x2, rectPropagated.y2, rectPropagated.objectId)
 				self.frames[self.curFrameNr].rects.append(rectPropagated)
 
 		# self.curFrame()
-		self.exportXMLFilename("save.xml")
 		return self.curImage
 
+	# Propagate the boxes of the given objects (all objects of frame first if
+	# objectIds is None) from frame first up to frame last, in either
+	# direction, with the tracker selected by the TRACKER option. In each
+	# frame the propagated boxes replace the boxes of the same objects, the
+	# other boxes are kept. Return the number of frames written.
+	def propagateRange(self, first, last, objectIds=None):
+		step = 1 if last >= first else -1
+		self.direction = step
+		rects = self.frames[first].rects
+		if objectIds != None:
+			ids = set(objectIds)
+			rects = [r for r in rects if r.objectId in ids]
+		rects = copyRects(rects)
+		tracker = getTracker()
+		if tracker != None:
+			self.curFrameNr = first
+			self.curFrame()
+		n = 0
+		for nr in range(first+step, last+step, step):
+			if len(rects) < 1:
+				break
+			self.curFrameNr = nr
+			if tracker == None:
+				rects = copyRects(rects)
+			else:
+				oldImage, oldKey = self.curImage, self.curKey
+				self.curFrame()
+				rects = tracker.trackRects(self.frameArray(oldKey, oldImage), self.frameArray(self.curKey, self.curImage), rects)
+			self.setObjectRects(nr, rects)
+			n += 1
+		return n
+
+	# The jobs of a parallel propagation (see parallel.py) from frame first
+	# up to frame last: (objectId, start, end, (x1, y1, x2, y2)), sorted by
+	# objectId and start. The objects are the given ones, or those of frame
+	# first. With keyframes, every box of an object in the range starts a
+	# job which ends before the next box of the object, so that the boxes
+	# already in the range are kept. Otherwise, each object is propagated
+	# from its box in frame first over the whole range.
+	def propagationJobs(self, first, last, objectIds=None, keyframes=False):
+		step = 1 if last >= first else -1
+		data, framecol = self.store.columns()
+		if objectIds == None:
+			objectIds = sorted(set([r.objectId for r in self.frames[first].rects]))
+		lo, hi = min(first, last), max(first, last)
+		inRange = (framecol >= lo) & (framecol <= hi)
+		jobs = []
+		for objectId in objectIds:
+			rows = np.flatnonzero(inRange & (data[:, OBJECTID] == objectId))
+			if keyframes:
+				# first box of the object in each frame, in the order of travel
+				nrs, idx = np.unique(framecol[rows], return_index=True)
+				starts = [(int(nr), rows[i]) for (nr, i) in zip(nrs, idx)][::step]
+				starts = [(nr, row) for (nr, row) in starts if (nr-first)*step >= 0]
+			else:
+				starts = [(first, row) for row in rows if framecol[row] == first][:1]
+			for k, (nr, row) in enumerate(starts):
+				end = starts[k+1][0]-step if k+1 < len(starts) else last
+				if end != nr:
+					jobs.append((objectId, nr, end, tuple([int(v) for v in data[row, X1:Y2+1]])))
+		jobs.sort()
+		return jobs
+
+	# Propagation of propagationJobs(first, last, objectIds, keyframes) on
+	# nprocs processes. The results are written in job order, so that they
+	# do not depend on the scheduling of the jobs. Return the number of
+	# boxes written.
+	def propagateParallel(self, first, last, objectIds=None, keyframes=False, nprocs=1):
+		jobs = self.propagationJobs(first, last, objectIds, keyframes)
+		paths = {}
+		for (objectId, start, end, box) in jobs:
+			step = 1 if end >= start else -1
+			for nr in range(start, end+step, step):
+				paths[nr] = self.filenames[nr]
+		results = parallel.runJobs(jobs, paths, decodeImageFile, getTracker, AARect, nprocs, cfg.PROPAGATE_WINDOW)
+		perFrame = {}
+		for (job, out) in zip(jobs, results):
+			for (nr, (x1, y1, x2, y2)) in out:
+				perFrame.setdefault(nr, []).append(AARect(x1, y1, x2, y2, job[0]))
+		for nr in sorted(perFrame.keys()):
+			self.setObjectRects(nr, perFrame[nr])
+		return sum([len(rects) for rects in perFrame.values()])
+
+	# Fill the frames between the boxes of each object (all objects, or the
+	# given objectIds) with linearly interpolated boxes, see
+	# AAStore.interpolate. With refine, the interpolated boxes are checked
+	# against the images, see refineInterpolation. Return the number of
+	# boxes added.
+	def interpolate(self, objectIds=None, refine=False):
+		framecol, data = self.store.interpolate(objectIds, cfg.INTERPOLATE_MAX_GAP)
+		if len(data) < 1:
+			return 0
+		if refine:
+			n = self.refineInterpolation(framecol, data)
+			print "Refined", n, "of", len(data), "interpolated boxes"
+		self.store.load(framecol, data)
+		self.checkpoint()
+		return len(data)
+
+	# Replace the interpolated boxes (framecol, data), sorted by objectId
+	# and frame, whose content does not look like the box of the same
+	# object in the previous frame by the result of the tracker from that
+	# box. The boxes are updated in place. Return the number of boxes
+	# replaced.
+	def refineInterpolation(self, framecol, data):
+		tracker = getTracker()
+		if tracker == None:
+			return 0
+		n = 0
+		for i in range(len(data)):
+			nr = int(framecol[i])
+			objectId = int(data[i, OBJECTID])
+			if i > 0 and framecol[i-1] == nr-1 and data[i-1, OBJECTID] == objectId:
+				prev = data[i-1].tolist()
+			else:
+				# the first box of a gap follows the keyframe box
+				prev = [(r.x1, r.y1, r.x2, r.y2, r.objectId) for r in self.frames[nr-1].rects if r.objectId == objectId][0]
+			prevArray = self.rgbFrameArray(nr-1)
+			curArray = self.rgbFrameArray(nr)
+			if appearanceScore(prevArray, prev, curArray, data[i]) < cfg.INTERPOLATE_MIN_NCC:
+				r = tracker.track(prevArray, curArray, AARect(*prev))
+				data[i, X1:Y2+1] = (r.x1, r.y1, r.x2, r.y2)
+				n += 1
+		return n
+
+	# The rgb frame nr as a numpy array, see frameArray
+	def rgbFrameArray(self, nr):
+		key = (self.filenames[nr], "rgb")
+		return self.frameArray(key)
+
+	# Replace the boxes of frame nr having the objectIds of the given
+	# rectangles by copies of them, add the boxes of the other objects
+	def setObjectRects(self, nr, rects):
+		frameRects = self.frames[nr].rects
+		index = dict([(r.objectId, i) for (i, r) in enumerate(frameRects)])
+		for r in rects:
+			i = index.get(r.objectId)
+			if i == None:
+				self.log("add", nr, r.x1, r.y1, r.x2, r.y2, r.objectId)
+				frameRects.append(r.copy())
+			else:
+				self.logRect("move", nr, i, r.x1, r.y1, r.x2, r.y2)
+				frameRects[i] = r.copy()
+
 	def changeFrame(self, id_frame):
+		if int(id_frame)-1 != self.curFrameNr:
+			self.direction = 1 if int(id_frame)-1 > self.curFrameNr else -1
 		self.curFrameNr=int(id_frame)-1
-		self.exportXMLFilename("save.xml")
 		return self.curFrame()
 
 	def nextFrameFar(self):
+		self.direction = 1
 		if self.curFrameNr<len(self.filenames)-JUMP_FRAMES:
 			self.curFrameNr+=JUMP_FRAMES
 		else:
 			self.curFrameNr=len(self.filenames)-1
-		self.exportXMLFilename("save.xml")
 		return self.curFrame()
 
 	def prevFrame(self):
+		self.direction = -1
 		if self.curFrameNr>0:
 			self.curFrameNr-=1
-		self.exportXMLFilename("save.xml")
 		return self.curFrame()
 
 	def prevFrameFar(self):
+		self.direction = -1
 		if self.curFrameNr>=JUMP_FRAMES:
 			self.curFrameNr-=JUMP_FRAMES
 		else:
 			self.curFrameNr=0
-		self.exportXMLFilename("save.xml")
 		return self.curFrame()
 
 	def getRects(self):
@@ -566,16 +1085,23 @@ class AAControler:
 			fnr=self.curFrameNr
 		if fnr>=len(self.frames):
 			raise Exception()
+		self.log("add", fnr, x1, y1, x2, y2, objectId)
 		self.frames[fnr].getRects().append(AARect(x1,y1,x2,y2,objectId))
 
 	def delRect(self,index):
+		self.logRect("del", self.curFrameNr, index)
 		del self.frames[self.curFrameNr].getRects()[index]
 
-	def getSemMousePos(self,x,y):
-		return self.frames[self.curFrameNr].getSemMousePos(x,y)
+	# The distance thresholds are in screen pixels, for a frame shown at
+	# scale screen pixels per frame pixel (by default the display scale)
+	def getSemMousePos(self,x,y,scale=None):
+		if scale == None:
+			scale = self.displayScale
+		return self.frames[self.curFrameNr].getSemMousePos(x,y,scale)
 
 	# Update the running id for a rectangle index
 	def updateobjectId(self,indexRect,newId):
+		self.logRect("id", self.curFrameNr, indexRect, newId)
 		self.frames[self.curFrameNr].rects[indexRect].objectId=newId
 		self.useobjectId(newId)
 
@@ -588,42 +1114,107 @@ class AAControler:
 				self.ClassAssignations.append(-1)
 		print "new run id array",self.ClassAssignations
 
+	# Assign the class classNr to the object objectId (counted from 1)
+	def setClass(self,objectId,classNr):
+		self.log("class", objectId, classNr)
+		self.ClassAssignations[objectId-1]=classNr
+
+	# Append a change of the rectangle index of frame nr to the journal,
+	# before it is made. The rectangle is identified by its objectId and
+	# coordinates: the backup XML does not keep the order of the
+	# rectangles of a frame.
+	def logRect(self, rtype, nr, index, *fields):
+		if self.journal == None:
+			return
+		r = self.frames[nr].rects[index]
+		self.log(rtype, nr, r.objectId, r.x1, r.y1, r.x2, r.y2, *fields)
+
+	# Append a change to the journal. The journal is started (or compacted,
+	# once it holds JOURNAL_COMPACT records) by writing the full annotation
+	# to the backup XML, and logging changes from there.
+	def log(self, *record):
+		if self.journal == None:
+			return
+		if not self.journal.isOpen() or self.journal.count >= cfg.JOURNAL_COMPACT:
+			self.checkpoint()
+		self.journal.record(*record)
+
+	# Write the backup XML and start a new journal, also used after changes
+	# too large to be journaled box by box
+	def checkpoint(self):
+		if self.journal == None:
+			return
+		self.exportXMLFilename(self.backupfilename)
+		self.journal.start()
+
+	# Apply the records of a journal on top of the current annotation
+	def replayJournal(self, journal):
+		n = 0
+		try:
+			for rtype, f in journal.records():
+				if rtype == "add":
+					self.frames[f[0]].rects.append(AARect(f[1],f[2],f[3],f[4],f[5]))
+					if len(self.ClassAssignations) < f[5]:
+						self.ClassAssignations += [-1]*(f[5]-len(self.ClassAssignations))
+				elif rtype == "move":
+					rects = self.frames[f[0]].rects
+					i = findRect(rects, f[1:6])
+					rects[i] = AARect(f[6], f[7], f[8], f[9], f[1])
+				elif rtype == "del":
+					rects = self.frames[f[0]].rects
+					del rects[findRect(rects, f[1:6])]
+				elif rtype == "clear":
+					self.frames[f[0]].rects = []
+				elif rtype == "id":
+					rects = self.frames[f[0]].rects
+					r = rects[findRect(rects, f[1:6])]
+					r.objectId = f[6]
+					if len(self.ClassAssignations) < f[6]:
+						self.ClassAssignations += [-1]*(f[6]-len(self.ClassAssignations))
+				elif rtype == "class":
+					self.ClassAssignations[f[0]-1] = f[1]
+				n += 1
+		except IndexError:
+			print >> sys.stderr, "The journal does not match the backup, stopped after", n, "changes"
+		print "Recovered", n, "changes from the journal"
+
 	def exportXML(self):
 		self.exportXMLFilename(self.outputfilename)
+		# everything is saved, the journal is not needed anymore
+		if self.journal != None:
+			self.journal.remove()
 
+	# Write the annotation to an XML file. The bounding boxes are grouped
+	# by objectId on the columns of the store, and written through a large
+	# output buffer.
 	def exportXMLFilename(self,filename):
-		# Get maximum running id
-		maxid=-1
-		for (i,f) in enumerate(self.frames):
-			for (j,r) in enumerate(f.getRects()):
-				if r.objectId > maxid:
-					maxid=r.objectId
+		data, framecol = self.store.columns()
 		try:
-			fd=open(filename,'w')
+			fd=open(filename,'w',XML_BUFFER_SIZE)
 		except:
-			tkMessageBox.showinfo(TITLE, "Could not save to the specified XML file. Please check the location. Does the directory exist?")
+			self.message("Could not save to the specified XML file. Please check the location. Does the directory exist?")
+			return
 		print >> fd, "<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
 		print >> fd, "<tagset>"
 		print >> fd, "  <video>"
 		print >> fd, "	<videoName>"+self.videoname+"</videoName>"
 
-		# self.filenames[self.curFrameNr]
 		# Travers all different running id's
-		for curObjectId in range(maxid):
-			foundRects=False
-			for (i,f) in enumerate(self.frames):
-				for (j,r) in enumerate(f.getRects()):
-					if r.objectId==curObjectId+1:
-						if not foundRects:
-							foundRects=True
-							fd.write ("	<object nr=\""+str(curObjectId+1)+"\" class=\""+str(self.ClassAssignations[curObjectId])+"\">\n")
-						s="	  <bbox x=\""+str(int(r.x1))+"\" y=\""+str(int(r.y1))
-						s=s+"\" width=\""+str(int(r.x2-r.x1+1))+"\" height=\""+str(int(r.y2-r.y1+1))
-						s=s+"\" framenr=\""+str(i+1)
-						s=s+"\" framefile=\""+self.filenames[i]+"\"/>\n"
-						fd.write(s)
-			if foundRects:
-				print >> fd, "	</object>"
+		for (objectId, rows) in self.store.objects():
+			if objectId < 1:
+				continue
+			lines=["	<object nr=\""+str(objectId)+"\" class=\""+str(self.ClassAssignations[objectId-1])+"\">\n"]
+			boxes=data[rows]
+			x=boxes[:,X1].tolist()
+			y=boxes[:,Y1].tolist()
+			w=(boxes[:,X2]-boxes[:,X1]+1).tolist()
+			h=(boxes[:,Y2]-boxes[:,Y1]+1).tolist()
+			frs=framecol[rows].tolist()
+			for k in range(len(frs)):
+				lines.append("	  <bbox x=\"%d\" y=\"%d\" width=\"%d\" height=\"%d\" framenr=\"%d\" framefile=\"%s\"/>\n" %
+					(x[k], y[k], w[k], h[k], frs[k]+1, self.filenames[frs[k]]))
+			lines.append("	</object>\n")
+			fd.write("".join(lines))
 		print >> fd, "  </video>"
 		print >> fd, "</tagset>"
 		fd.close()
@@ -631,13 +1222,15 @@ class AAControler:
 	def exportXML2voc(self):
 		print "Exporting..."
 		mkdir_p(self.vocPath)
-		for (i,f) in enumerate(self.frames):
+		data, framecol = self.store.columns()
+		offsets = self.store.offsets
+		for i in range(len(self.frames)):
 			head, tail = os.path.split(self.filenames[i])
 			filename = self.vocPath+tail[:-3]+"xml"
 			try:
 				fd=open(filename,'w')
 			except:
-				tkMessageBox.showinfo(TITLE, "Could not save to the specified XML file. Please check the location. Does the directory exist?")
+				self.message("Could not save to the specified XML file. Please check the location. Does the directory exist?")
 
 			print >> fd, "<annotation>"
 			print >> fd, "	<folder>"+self.folderName+"</folder>"
@@ -647,24 +1240,24 @@ class AAControler:
 			print >> fd, "	</source>"
 			print >> fd, "	<owner>"+self.owner+"</owner>"
 			print >> fd, "	<size>"
-			print >> fd, "		<width>640</width>"
-			print >> fd, "		<height>480</height>"
+			print >> fd, "		<width>"+str(self.frameIndex.size[0])+"</width>"
+			print >> fd, "		<height>"+str(self.frameIndex.size[1])+"</height>"
 			print >> fd, "		<depth>1</depth>"
 			print >> fd, "	</size>"
 			print >> fd, "	<segmented>0</segmented>"
 
 
-			for (j,r) in enumerate(f.getRects()):
+			for (x1,y1,x2,y2,objectId) in data[offsets[i]:offsets[i+1]].tolist():
 				print >> fd, "	<object>"
-				print >> fd, "		<name>"+classnames[self.ClassAssignations[r.objectId-1]]+"</name>"
+				print >> fd, "		<name>"+classnames[self.ClassAssignations[objectId-1]]+"</name>"
 				print >> fd, "		<pose>unknown</pose>"
 				print >> fd, "		<truncated>-1</truncated>"
 				print >> fd, "		<difficult>0</difficult>"
 				print >> fd, "		<bndbox>"
-				print >> fd, "			<xmin>"+str(int(r.x1))+"</xmin>"
-				print >> fd, "			<ymin>"+str(int(r.y1))+"</ymin>"
-				print >> fd, "			<xmax>"+str(int(r.x2))+"</xmax>"
-				print >> fd, "			<ymax>"+str(int(r.y2))+"</ymax>"
+				print >> fd, "			<xmin>"+str(x1)+"</xmin>"
+				print >> fd, "			<ymin>"+str(y1)+"</ymin>"
+				print >> fd, "			<xmax>"+str(x2)+"</xmax>"
+				print >> fd, "			<ymax>"+str(y2)+"</ymax>"
 				print >> fd, "		</bndbox>"
 				print >> fd, "	</object>"
 
@@ -673,65 +1266,79 @@ class AAControler:
 
 		print "Done !"
 
-	def parseXML(self):
-		tree = xml.parse(self.outputfilename)
-		rootElement = tree.getroot()
-
-		# Get the single video tag
-		vids=tree.findall("video")
-		if len(vids)<1:
-			tkMessageBox.showinfo(TITLE, "No <video> tag found in the input XML file!")
-			sys.exit(1)
-		if len(vids)>1:
-			tkMessageBox.showinfo(TITLE, "Currently only a single <video> tag is supported per XML file!")
-			sys.exit(1)
-		vid=vids[0]
-
-		# Get the video name
-		#x=getSingleTag(vid,"videoName")
-		#if (x.text is None) or (len(x.text)==0) or (x.text=="NO-NAME"):
-		#	tkMessageBox.showinfo(TITLE, "The video name in the given XML file is empty. Please provide the correct name before saving the file.")
-		#	self.videoname="NO-NAME"
-		#else:
-		#	self.videoname=x.text
-
-		# Get all the objects
-		objectnodes=vid.findall("object")
-		if len(objectnodes)<1:
-			tkMessageBox.showinfo(TITLE, "The given XML file does not contain any objects.")
-		for a in objectnodes:
-			# Add the classnr to the objectId array. Grow if necessary
-			anr=int(getAtt(a,"nr"))
-			aclass=int(getAtt(a,"class"))
-			# print "-----",anr,aclass
-			# print len(self.ClassAssignations)
-			if len(self.ClassAssignations)<anr:
-				# print "Growing objectId:"
-				self.ClassAssignations += [None]*(anr-len(self.ClassAssignations))
-			self.ClassAssignations[anr-1]=aclass
-			# print "size of objectId array:", len(self.ClassAssignations), "array:", self.ClassAssignations
-
-			# Get all the bounding boxes for this object
-			bbs=a.findall("bbox")
-			if len(bbs)<1:
-				tkMessageBox.showinfo(TITLE, "No <bbox> tags found for an object in the input XML file!")
-				sys.exit(1)
-			for bb in bbs:
-
+	# Load an annotation XML file into the frames. The file is read as a
+	# stream (iterparse), elements are cleared once they are handled, so
+	# the tree is never held in memory.
+	def parseXML(self, filename=None):
+		if filename == None:
+			filename = self.outputfilename
+
+		nvids=0
+		nobjects=0
+		nboxes=0
+		nframes=len(self.frames)
+		# columns of the loaded boxes, handed to the store at the end
+		framecol=array.array('l')
+		boxes=array.array('i')
+		# depth of the current element: 0 tagset, 1 video, 2 object, 3 bbox
+		depth=-1
+		vid=None
+		for (event,node) in xml.iterparse(filename, events=("start","end")):
+			if event=="start":
+				depth+=1
+				if depth==1 and node.tag=="video":
+					nvids+=1
+					if nvids>1:
+						self.message("Currently only a single <video> tag is supported per XML file!")
+						sys.exit(1)
+					vid=node
+				elif depth==2 and node.tag=="object" and vid!=None:
+					# Add the classnr to the objectId array. Grow if necessary
+					anr=int(getAtt(node,"nr",self.message))
+					aclass=int(getAtt(node,"class",self.message))
+					if len(self.ClassAssignations)<anr:
+						self.ClassAssignations += [None]*(anr-len(self.ClassAssignations))
+					self.ClassAssignations[anr-1]=aclass
+					nobjects+=1
+					objectboxes=0
+				continue
+
+			depth-=1
+			if depth==2 and node.tag=="bbox" and vid!=None:
 				# Add the bounding box to the frames() list
-				bfnr=int(getAtt(bb,"framenr"))
-				bx=int(getAtt(bb,"x"))
-				by=int(getAtt(bb,"y"))
-				bw=int(getAtt(bb,"width"))
-				bh=int(getAtt(bb,"height"))
-				try:
-					self.addRect(bx,by,bx+bw-1,by+bh-1,anr,bfnr-1)
-				except:
+				bfnr=int(getAtt(node,"framenr",self.message))
+				bx=int(getAtt(node,"x",self.message))
+				by=int(getAtt(node,"y",self.message))
+				bw=int(getAtt(node,"width",self.message))
+				bh=int(getAtt(node,"height",self.message))
+				if bfnr<1 or bfnr>nframes:
 					print "*** ERROR ***"
 					print "The XML file contains rectangles in frame numbers which are outside of the video"
-					print "(frame number too large). Please check whether the XML file really fits to these"
-					print "frames."
+					print "(frame number "+str(bfnr)+", the video has "+str(nframes)+" frames). Please check"
+					print "whether the XML file really fits to these frames."
 					sys.exit(1)
+				framecol.append(bfnr-1)
+				boxes.extend((bx,by,bx+bw-1,by+bh-1,anr))
+				objectboxes+=1
+				nboxes+=1
+				if nboxes % PARSE_PROGRESS == 0:
+					print "Loaded", nboxes, "boxes"
+				node.clear()
+			elif depth==1 and node.tag=="object" and vid!=None:
+				if objectboxes<1:
+					self.message("No <bbox> tags found for an object in the input XML file!")
+					sys.exit(1)
+				node.clear()
+				# drop the handled objects from the video element
+				vid.clear()
+
+		if nvids<1:
+			self.message("No <video> tag found in the input XML file!")
+			sys.exit(1)
+		if nobjects<1:
+			self.message("The given XML file does not contain any objects.")
+		self.store.load(np.frombuffer(framecol, dtype=np.int_), np.frombuffer(boxes, dtype=np.intc))
+		print "Loaded", nobjects, "objects,", nboxes, "boxes"
 
 # ***************************************************************************
 # GUI
@@ -753,8 +1360,6 @@ class Example(Frame):
 		self.parent = parent
 		self.curPath = aCurPath
 		self.ct = AAControler();
-		fontPath = os.path.dirname(os.path.realpath(__file__))
-		self.imgFont = ImageFont.truetype(fontPath + "/FreeSans.ttf", 30)
 		self.initUI()
 		self.eventcounter = 0
 
@@ -763,21 +1368,27 @@ class Example(Frame):
 	def initUI(self):
 		self.parent.title(TITLE+" (frame nr.1 of "+str(len(self.ct.filenames))+")")
 		self.pack(fill=BOTH, expand=1)
-		self.img = self.ct.curFrame()
+		self.imageSize = self.ct.frameSize()
+		self.ct.displayScale = self.fitDisplayScale()
+		print "display scale", self.ct.displayScale
+		self.ct.curFrame()
+		self.img = self.ct.displayFrame()
+		self.viewport = Viewport(self.img.size[0], self.img.size[1], self.ct.displayScale,
+			max(cfg.ZOOM_MAX, self.ct.displayScale), cfg.VIEW_TILES)
 		self.curFrame = ImageTk.PhotoImage(self.img)
 
 		self.imgTrash = ImageTk.PhotoImage(Image.open(self.curPath+"/trashcan.png"))
 		self.imgMove = ImageTk.PhotoImage(Image.open(self.curPath+"/move.png"))
 		# create canvas
 		self.canvas = Canvas(self.parent, width=self.img.size[0], height=self.img.size[1])
+		self.canvasSize = self.img.size
 
 		# create scale bar
 		self.scalevar = IntVar()
 		self.xscale = Scale(self.parent,variable = self.scalevar,from_=1, to=len(self.ct.filenames), orient=HORIZONTAL, command=self.changeFrame)
 
 
-		self.canvas.create_image(0, 0, anchor=NW, image=self.curFrame)
-
+		self.initCanvasItems()
 
 
 		self.objectIdbox = Listbox(self.parent)
@@ -813,6 +1424,18 @@ class Example(Frame):
 		self.canvas.bind ("s", self.saveXML)
 		self.canvas.bind ("f", self.nextFrameWPropForced)
 		self.canvas.bind ("p", self.nextFrameWPropForcedSelectedRect)
+		self.canvas.bind ("i", self.interpolate)
+		self.canvas.bind ("b", self.toggleBlend)
+		self.canvas.bind ("<plus>", self.moreDepth)
+		self.canvas.bind ("<minus>", self.lessDepth)
+		self.canvas.bind ("<MouseWheel>", self.mouseWheel)
+		self.canvas.bind ("<Button-4>", self.mouseWheel)
+		self.canvas.bind ("<Button-5>", self.mouseWheel)
+		self.canvas.bind ("z", self.zoomIn)
+		self.canvas.bind ("Z", self.zoomOut)
+		self.canvas.bind ("<Home>", self.zoomReset)
+		self.canvas.bind ("<Button-2>", self.panStart)
+		self.canvas.bind ("<B2-Motion>", self.panMove)
 		self.canvas.bind ("d", self.deleteCurRect)
 		self.canvas.bind ("D", self.deleteAllRects)
 		self.canvas.bind ("1", self.choseobjectId1)
@@ -839,14 +1462,33 @@ class Example(Frame):
 		self.state=""
 		self.mousex = 1
 		self.mousey = 1
+		self.canvasx = 1
+		self.canvasy = 1
 		self.objectIdProposed4NewRect=1
 		self.displayAnno()
 		self.displayClassAssignations()
 		self.fnEntry.delete(0, END)
 		self.fnEntry.insert(0, self.ct.videoname)
-		self.isModified=False
+		self.isModified=self.ct.recovered
 		self.canvas.focus_force()
 
+	# The display scale of the frames: DISPLAY_SCALE, or if it is 0 the
+	# largest scale up to 1 at which the frames fit on the screen
+	def fitDisplayScale(self):
+		if cfg.DISPLAY_SCALE > 0:
+			return float(cfg.DISPLAY_SCALE)
+		w = self.parent.winfo_screenwidth()-DISPLAY_MARGIN_X
+		h = self.parent.winfo_screenheight()-DISPLAY_MARGIN_Y
+		return min(1., float(w)/self.imageSize[0], float(h)/self.imageSize[1])
+
+	# Convert a position on the canvas to frame coordinates
+	def toImage(self, x, y):
+		return self.viewport.toImage(x, y)
+
+	# Convert frame coordinates to canvas coordinates
+	def toCanvas(self, *coords):
+		return self.viewport.toCanvas(*coords)
+
 	def checkValidity(self):
 		msg=self.ct.checkValidity()
 		if len(self.fnEntry.get())<1:
@@ -856,13 +1498,14 @@ class Example(Frame):
 
 	def quit(self,event):
 		print "quit method"
+		print self.ct.frameCache.stats()
 		self.ct.videoname=self.fnEntry.get()
 
 		ok=True
 
 		if self.isModified:
 			if tkMessageBox.askyesno( title='Unsaved changes', message='The annotation has been modified. Do you really want to quit?'):
-				tkMessageBox.showinfo ("First help","A backup of the latest changes can be found in save.xml, just in case.")
+				tkMessageBox.showinfo ("First help","The latest changes are kept in "+self.ct.journalfilename+" and "+self.ct.backupfilename+", they will be offered for recovery at the next start.")
 			else:
 				ok=False
 
@@ -871,14 +1514,68 @@ class Example(Frame):
 			# close tracking library
 			if trackingLib != None:
 				trackingLib.close_lib()
+			if self.ct.readAhead != None:
+				self.ct.readAhead.close()
+			self.ct.journal.close()
 			self.parent.destroy()
 
 
 	def updateAfterJump(self):
-		self.curFrame = ImageTk.PhotoImage(self.img)
-		self.displayAnno()
+		self.updateView()
 		self.parent.title(TITLE+" (frame nr."+str(self.ct.curFrameNr+1)+" of "+str(len(self.ct.filenames))+")")
 		self.canvas.update()
+
+	# Show the visible part of the current frame and the rectangles over it.
+	# Once zoomed in beyond the display scale, the view is rendered from
+	# the frame at the size of its file.
+	def updateView(self):
+		size = self.ct.displayFrame().size
+		if size != self.canvasSize:
+			# the side by side view is twice as wide
+			self.canvasSize = size
+			self.canvas.config(width=size[0], height=size[1])
+			self.viewport.reset(size[0], size[1], self.ct.displayScale)
+		if self.viewport.zoom > self.ct.displayScale:
+			key, img = self.ct.viewFrame(True)
+			self.img = self.viewport.render(img, key, 1.)
+		else:
+			key, img = self.ct.viewFrame()
+			self.img = self.viewport.render(img, key, self.ct.displayScale)
+		self.curFrame = ImageTk.PhotoImage(self.img)
+		self.canvas.itemconfig(self.frameItem, image=self.curFrame)
+		self.displayAnno()
+
+	# Zoom in or out around the canvas position x,y
+	def zoomAt(self, factor, x, y):
+		self.viewport.zoomAt(factor, x, y)
+		self.updateView()
+
+	# Mouse wheel: <MouseWheel> on Windows and Mac OS, buttons 4 and 5 on X11
+	def mouseWheel(self,event):
+		if event.num == 4 or getattr(event, "delta", 0) > 0:
+			self.zoomAt(ZOOM_STEP, event.x, event.y)
+		else:
+			self.zoomAt(1./ZOOM_STEP, event.x, event.y)
+
+	def zoomIn(self,event):
+		self.zoomAt(ZOOM_STEP, self.canvasx, self.canvasy)
+
+	def zoomOut(self,event):
+		self.zoomAt(1./ZOOM_STEP, self.canvasx, self.canvasy)
+
+	def zoomReset(self,event):
+		self.viewport.reset(self.canvasSize[0], self.canvasSize[1], self.ct.displayScale)
+		self.updateView()
+
+	# Pan the view by dragging with the middle button
+	def panStart(self,event):
+		self.panx = event.x
+		self.pany = event.y
+
+	def panMove(self,event):
+		self.viewport.pan(event.x-self.panx, event.y-self.pany)
+		self.panStart(event)
+		self.updateView()
 	def changeFrame(self,id_frame):
 		self.img = self.ct.changeFrame(id_frame)
 		self.updateAfterJump()
@@ -910,7 +1607,7 @@ class Example(Frame):
 		self.isModified=True
 
 	def nextFrameWPropForcedSelectedRect(self,event):
-		sempos = self.ct.getSemMousePos(self.mousex,self.mousey)
+		sempos = self.ct.getSemMousePos(self.mousex,self.mousey,self.viewport.zoom)
 		if sempos.index > -1:
 			self.img = self.ct.nextFramePropCurrentRect(sempos.index)
 		self.updateAfterJump()
@@ -920,11 +1617,15 @@ class Example(Frame):
 		# self.debugEvent('mouseMove')
 
 		self.displayAnno()
-		self.mousex = event.x
-		self.mousey = event.y
+		# the positions of the rectangles are in frame coordinates
+		(x, y) = self.toImage(event.x, event.y)
+		self.mousex = x
+		self.mousey = y
+		self.canvasx = event.x
+		self.canvasy = event.y
 
-	 	maxx = self.img.size[0]
-		maxy = self.img.size[1]
+		maxx = self.imageSize[0]
+		maxy = self.imageSize[1]
 
 		# print "mouse x,y = ",self.mousex,",",self.mousey
 
@@ -936,10 +1637,9 @@ class Example(Frame):
 
 		if self.state=="d":
 			# We currently draw a rectangle
-			self.curx2=min(maxx,max(1,event.x))
-			self.cury2=min(maxy,max(1,event.y))
-			self.canvas.create_rectangle(self.curx1, self.cury1, self.curx2, self.cury2,
-				outline="blue", width=2)
+			self.curx2=min(maxx,max(1,x))
+			self.cury2=min(maxy,max(1,y))
+			self.showDragRect()
 		elif self.state=="i":
 			# We currently choose a running id
 			self.propobjectId = self.curObjectId+(event.y-self.oldY)/20
@@ -947,47 +1647,43 @@ class Example(Frame):
 				self.propobjectId=0
 			if self.propobjectId>MAX_objectId:
 				self.propobjectId=MAX_objectId
-			self.canvas.create_rectangle(self.curx1,self.cury1,self.curx1+30,
-			self.cury1+30, outline="white", fill="white")
-			self.canvas.create_text(self.curx1+15,self.cury1+15, text=str(self.propobjectId),
-			fill="blue", font=("Helvectica", "20"))
+			(cx, cy) = self.toCanvas(self.curx1, self.cury1)
+			self.canvas.coords(self.idBoxItem, cx, cy, cx+30, cy+30)
+			self.canvas.coords(self.idTextItem, cx+15, cy+15)
+			self.canvas.itemconfig(self.idTextItem, text=str(self.propobjectId))
+			self.canvas.itemconfig("idbox", state=NORMAL)
 		elif self.state=="ul":
 			# We currently move the upper left corner
-			self.curx1=min(maxx,max(1,event.x))
-			self.cury1=min(maxy,max(1,event.y))
-			self.canvas.create_rectangle(self.curx1, self.cury1, self.curx2, self.cury2,
-			outline="blue", width=2)
+			self.curx1=min(maxx,max(1,x))
+			self.cury1=min(maxy,max(1,y))
+			self.showDragRect()
 			# ELtodo self.drawAnchorPoint(self.curx1, self.cury1)
 		elif self.state=="ur":
 			# We currently move the upper right corner
-			self.curx2=min(maxx,max(1,event.x))
-			self.cury1=min(maxy,max(1,event.y))
-			self.canvas.create_rectangle(self.curx1, self.cury1, self.curx2, self.cury2,
-			outline="blue", width=2)
+			self.curx2=min(maxx,max(1,x))
+			self.cury1=min(maxy,max(1,y))
+			self.showDragRect()
 			# ELtodo self.drawAnchorPoint(self.curx2, self.cury1)
 		# We currently move the lower left corner
 		elif self.state=="ll":
-			self.curx1=min(maxx,max(1,event.x))
-			self.cury2=min(maxy,max(1,event.y))
-			self.canvas.create_rectangle(self.curx1, self.cury1, self.curx2, self.cury2,
-			outline="blue", width=2)
+			self.curx1=min(maxx,max(1,x))
+			self.cury2=min(maxy,max(1,y))
+			self.showDragRect()
 			# ELtodo self.drawAnchorPoint(self.curx1, self.cury2)
 		elif self.state=="lr":
 			# We currently move the lower right corner
-			self.curx2=min(maxx,max(1,event.x))
-			self.cury2=min(maxy,max(1,event.y))
-			self.canvas.create_rectangle(self.curx1, self.cury1, self.curx2, self.cury2,
-			outline="blue", width=2)
+			self.curx2=min(maxx,max(1,x))
+			self.cury2=min(maxy,max(1,y))
+			self.showDragRect()
 			# ELtodo self.drawAnchorPoint(self.curx2, self.cury2)
 		elif self.state=="c":
 			# We currently move the whole rectangle
-			self.curx1=min(maxx-10,max(1,event.x-int(0.5*self.curwidth)))
-			self.cury1=min(maxy-10,max(1,event.y-int(0.5*self.curheigth)))
-			self.curx2=min(maxx,max(self.curx1+10,max(1,event.x+int(0.5*self.curwidth))))
-			self.cury2=min(maxy,max(self.cury1+10,max(1,event.y+int(0.5*self.curheigth))))
+			self.curx1=min(maxx-10,max(1,x-int(0.5*self.curwidth)))
+			self.cury1=min(maxy-10,max(1,y-int(0.5*self.curheigth)))
+			self.curx2=min(maxx,max(self.curx1+10,max(1,x+int(0.5*self.curwidth))))
+			self.cury2=min(maxy,max(self.cury1+10,max(1,y+int(0.5*self.curheigth))))
 
-			self.canvas.create_rectangle(self.curx1, self.cury1, self.curx2, self.cury2,
-			outline="blue", width=2)
+			self.showDragRect()
 			# ELtodo self.drawAnchorPoint(event.x, event.y)
 			# Drag outside of the canvas -> delete
 			# if (event.x<0) or (event.x>self.img.size[0]) or (event.y<0) or (event.y>self.img.size[1]):
@@ -1016,6 +1712,34 @@ class Example(Frame):
 		self.img = self.ct.curFrame()
 		self.updateAfterJump()
 
+	# Show or hide the blended view of the rgb and depth frames
+	def toggleBlend(self,event):
+		if not self.ct.depth_available:
+			return
+		self.ct.blendActivated = not self.ct.blendActivated
+		self.updateAfterJump()
+
+	# Change the weight of the depth frame in the blended view
+	def moreDepth(self,event):
+		self.changeBlend(0.1)
+
+	def lessDepth(self,event):
+		self.changeBlend(-0.1)
+
+	def changeBlend(self,delta):
+		self.ct.blendAlpha = min(max(self.ct.blendAlpha+delta, 0.), 1.)
+		if self.ct.blendActivated:
+			self.updateAfterJump()
+
+	# Fill the frames between the boxes of each object by interpolation
+	def interpolate(self,event):
+		n = self.ct.interpolate(None, cfg.INTERPOLATE_REFINE)
+		print "Interpolated", n, "boxes"
+		self.displayAnno()
+		self.canvas.update()
+		if n > 0:
+			self.isModified=True
+
 	# Remove all rectangles of the current frame
 	def deleteAllRects(self,event):
 		self.ct.deleteAllRects()
@@ -1025,7 +1749,7 @@ class Example(Frame):
 
 	# Remove the currently selected rectangle of the current frame
 	def deleteCurRect(self,event):
-		sempos = self.ct.getSemMousePos(self.mousex,self.mousey)
+		sempos = self.ct.getSemMousePos(self.mousex,self.mousey,self.viewport.zoom)
 		if sempos.index > -1:
 			self.ct.deleteRect(sempos.index)
 			self.displayAnno()
@@ -1044,7 +1768,7 @@ class Example(Frame):
 
 		# Which rectangle is the nearest one to the mouse cursor, and what is
 		# its relative position (corners, center, general position)?
-		sempos = self.ct.getSemMousePos(self.mousex,self.mousey)
+		sempos = self.ct.getSemMousePos(self.mousex,self.mousey,self.viewport.zoom)
 
 		# We change an existing rectangle. Remove the old one from the
 		# controler
@@ -1064,8 +1788,7 @@ class Example(Frame):
 		else:
 			self.state="d"
 			self.curObjectId=self.objectIdProposed4NewRect
-			self.curx1=event.x
-			self.cury1=event.y
+			(self.curx1, self.cury1) = self.toImage(event.x, event.y)
 			self.curx2=-1
 			self.cury2=-1
 
@@ -1081,13 +1804,14 @@ class Example(Frame):
 			self.rightMouseUp(event)
 			return
 
+		(x, y) = self.toImage(event.x, event.y)
 		if self.state in ("ul","ur","ll","lr","c","d"):
 			# Are we inside the window?
 			if True: #not ((event.x<0) or (event.x>self.img.size[0]) or (event.y<0) or (event.y>self.img.size[1])):
 
 				# If we create a new rectangle, we check whether we moved
 				# since the first click (Non trivial rectangle)?
-				if (self.state!="d") or (abs(event.x-self.curx1)>5) or (abs(event.y-self.cury1)>5):
+				if (self.state!="d") or (abs(x-self.curx1)*self.viewport.zoom>5) or (abs(y-self.cury1)*self.viewport.zoom>5):
 
 					self.ct.addRect(self.curx1,self.cury1,self.curx2,self.cury2,self.curObjectId);
 					self.isModified=True
@@ -1096,14 +1820,16 @@ class Example(Frame):
 						self.ct.useobjectId(self.curObjectId)
 						self.displayClassAssignations()
 						self.objectIdProposed4NewRect = self.objectIdProposed4NewRect+1
-			self.curx2=event.x
-			self.cury2=event.y
+			self.curx2=x
+			self.cury2=y
 		self.state=""
+		self.canvas.itemconfig(self.dragItem, state=HIDDEN)
 		self.displayAnno()
 
 	def rightMouseDown(self,event):
 		print "right mouse down"
-		sempos=self.ct.getSemMousePos(event.x,event.y)
+		(x, y) = self.toImage(event.x, event.y)
+		sempos=self.ct.getSemMousePos(x,y,self.viewport.zoom)
 		self.curSempos = sempos
 		self.oldY=event.y
 		print "sempos.index",sempos.index
@@ -1120,9 +1846,11 @@ class Example(Frame):
 			self.displayClassAssignations()
 			self.isModified=True
 		self.state=""
+		self.canvas.itemconfig("idbox", state=HIDDEN)
+		self.displayAnno()
 
 	def choseobjectId(self,event,id):
-		sempos=self.ct.getSemMousePos(self.mousex,self.mousey)
+		sempos=self.ct.getSemMousePos(self.mousex,self.mousey,self.viewport.zoom)
 		print "choseobjectId(self,event,id):",sempos.index, "pos: ",self.mousex,",",self.mousey
 		if sempos.index>-1:
 			self.ct.updateobjectId(sempos.index,id)
@@ -1132,18 +1860,29 @@ class Example(Frame):
 
 
 
-	# draw an anchor point at (x, y) coordinates
-	def drawAnchorPoint(self, draw, x, y, size=5, color="cyan"):
-		x1 = x-size
-		y1 = y-size
-		x2 = x+size
-		y2 = y+size
-		draw.ellipse([x1, y1, x2, y2], outline=color)
-		draw.ellipse([x1+1, y1+1, x2-1, y2-1], outline=color)
-		draw.ellipse([x1+2, y1+2, x2-2, y2-2], outline=color)
-
-
-	# Draw the image and the current annotation
+	# Create the persistent canvas items: the frame image, the rectangle
+	# being drawn or moved, the anchor point and the running id chooser.
+	# The rectangles of the frame get a pair of items each (see displayAnno).
+	def initCanvasItems(self):
+		self.frameItem = self.canvas.create_image(0, 0, anchor=NW, image=self.curFrame)
+		# for each rectangle: [rectangle item, label item, drawn state]
+		self.boxItems = []
+		self.dragItem = self.canvas.create_rectangle(0, 0, 0, 0, outline="blue", width=2,
+			state=HIDDEN, tags="overlay")
+		self.anchorItem = self.canvas.create_oval(0, 0, 0, 0, outline="cyan", width=3,
+			state=HIDDEN, tags="overlay")
+		self.idBoxItem = self.canvas.create_rectangle(0, 0, 0, 0, outline="white", fill="white",
+			state=HIDDEN, tags=("overlay", "idbox"))
+		self.idTextItem = self.canvas.create_text(0, 0, fill="blue", font=("Helvectica", "20"),
+			state=HIDDEN, tags=("overlay", "idbox"))
+
+	# Show the rectangle currently drawn or moved
+	def showDragRect(self):
+		self.canvas.coords(self.dragItem, *self.toCanvas(self.curx1, self.cury1, self.curx2, self.cury2))
+		self.canvas.itemconfig(self.dragItem, state=NORMAL)
+
+	# Update the canvas items to the current annotation. Only the items of
+	# rectangles which changed since the last call are touched.
 	def displayAnno(self):
 		if self.state in ("ul","ur","ll","lr","c","d","i"):
 			# We are currently in an operation, so do not search
@@ -1155,41 +1894,61 @@ class Example(Frame):
 			# which rectangle is the nearest one to the mouse cursor,
 			# and what is its relative position (corners, center,
 			# general position)?
-			sempos = self.ct.getSemMousePos(self.mousex,self.mousey)
-
-		# Init drawing
-		drawFrame = self.img.copy()
-		draw = ImageDraw.Draw(drawFrame)
+			sempos = self.ct.getSemMousePos(self.mousex,self.mousey,self.viewport.zoom)
 
-		# Draw all rectangles
-		for (i,r) in enumerate(self.ct.getRects()):
+		rects = self.ct.getRects()
+		created = False
+		for (i,r) in enumerate(rects):
 			if i == sempos.index:
 				curcol = "blue"
 			else:
 				curcol = "red"
-			draw.rectangle([r.x1, r.y1, r.x2, r.y2], outline=curcol)
-			draw.rectangle([r.x1+1, r.y1+1, r.x2-1, r.y2-1], outline=curcol)
-			draw.text([r.x1+3, r.y1+2], str(r.objectId), font=self.imgFont, fill=curcol)
-
-
-			# Draw the icons
-			if i == sempos.index:
-				if sempos.sempos == "ul":
-					self.drawAnchorPoint(draw, r.x1, r.y1)
-				if sempos.sempos == "ur":
-					self.drawAnchorPoint(draw, r.x2, r.y1)
-				if sempos.sempos == "ll":
-					self.drawAnchorPoint(draw, r.x1, r.y2)
-				if sempos.sempos == "lr":
-					self.drawAnchorPoint(draw, r.x2, r.y2)
-				if sempos.sempos == "c":
-					cx=0.5*(r.x1+r.x2)
-					cy=0.5*(r.y1+r.y2)
-					self.drawAnchorPoint(draw, cx, cy)
-
-		del draw
-		self.drawPhoto = ImageTk.PhotoImage(drawFrame)
-		self.canvas.create_image(0, 0, anchor=NW, image=self.drawPhoto)
+			drawn = (r.x1, r.y1, r.x2, r.y2, r.objectId, curcol, self.viewport.zoom, self.viewport.ux, self.viewport.uy)
+			if i < len(self.boxItems):
+				items = self.boxItems[i]
+				if items[2] == drawn:
+					continue
+				(x1, y1, x2, y2) = self.toCanvas(r.x1, r.y1, r.x2, r.y2)
+				self.canvas.coords(items[0], x1, y1, x2, y2)
+				self.canvas.coords(items[1], x1+3, y1+2)
+				self.canvas.itemconfig(items[0], outline=curcol)
+				self.canvas.itemconfig(items[1], text=str(r.objectId), fill=curcol)
+				items[2] = drawn
+			else:
+				(x1, y1, x2, y2) = self.toCanvas(r.x1, r.y1, r.x2, r.y2)
+				rectItem = self.canvas.create_rectangle(x1, y1, x2, y2, outline=curcol, width=2)
+				labelItem = self.canvas.create_text(x1+3, y1+2, anchor=NW, text=str(r.objectId),
+					fill=curcol, font=LABEL_FONT)
+				self.boxItems.append([rectItem, labelItem, drawn])
+				created = True
+
+		# Remove the items of rectangles which do not exist anymore
+		for items in self.boxItems[len(rects):]:
+			self.canvas.delete(items[0], items[1])
+		del self.boxItems[len(rects):]
+		if created:
+			self.canvas.tag_raise("overlay")
+
+		# Draw the anchor point
+		anchor = None
+		if 0 <= sempos.index < len(rects):
+			r = rects[sempos.index]
+			if sempos.sempos == "ul":
+				anchor = (r.x1, r.y1)
+			elif sempos.sempos == "ur":
+				anchor = (r.x2, r.y1)
+			elif sempos.sempos == "ll":
+				anchor = (r.x1, r.y2)
+			elif sempos.sempos == "lr":
+				anchor = (r.x2, r.y2)
+			elif sempos.sempos == "c":
+				anchor = (0.5*(r.x1+r.x2), 0.5*(r.y1+r.y2))
+		if anchor == None:
+			self.canvas.itemconfig(self.anchorItem, state=HIDDEN)
+		else:
+			(x, y) = self.toCanvas(*anchor)
+			self.canvas.coords(self.anchorItem, x-ANCHOR_SIZE, y-ANCHOR_SIZE, x+ANCHOR_SIZE, y+ANCHOR_SIZE)
+			self.canvas.itemconfig(self.anchorItem, state=NORMAL)
 
 	def displayClassAssignations(self):
 		self.objectIdbox.delete(0, END)
@@ -1218,7 +1977,7 @@ class Example(Frame):
 
 	def choseClassNr(self,classNr):
 		objectId=int(self.clickedobjectId[0])
-		self.ct.ClassAssignations[objectId]=classNr
+		self.ct.setClass(objectId+1,classNr)
 		self.classDlg.destroy()
 		self.displayClassAssignations()
 		# Put the focus on the canvas, else the listbox gets all events
@@ -1260,14 +2019,9 @@ def onexit():
 trackingLib = None
 
 
-def main():
-	curPath=sys.path[0]
-
+# Load the configuration of the sequence folder
+def loadConfig(folder_path):
 	global classnames
-	global trackingLib
-	#print "Script installed at: ",curPath
-
-	folder_path = sys.argv[1]
 	cfg_file=folder_path+'config.yml'
 	print "Loading config from", cfg_file
 	cfg_from_file(cfg_file)
@@ -1281,18 +2035,24 @@ def main():
 	classnames = cfg.CLASSES
 
 
-	# load C++ JM tracking library
-	if os.name == 'posix':
-		# ---- Mac Os
-		if platform.system() == 'Darwin':
-			trackingLib = ctypes.CDLL(curPath+"/boxtracking/libboxtracking.dylib")
+# load C++ JM tracking library
+def loadTrackingLib(curPath):
+	global trackingLib
+	try:
+		if os.name == 'posix':
+			# ---- Mac Os
+			if platform.system() == 'Darwin':
+				trackingLib = ctypes.CDLL(curPath+"/boxtracking/libboxtracking.dylib")
 
-		# ---- Linux
-		else:
-			trackingLib = ctypes.CDLL(curPath+"/boxtracking/libboxtracking.so")
-	# ---- Windows
-	elif os.name == 'nt':
-		trackingLib = ctypes.CDLL(curPath+"/boxtracking/libboxtracking.dll")
+			# ---- Linux
+			else:
+				trackingLib = ctypes.CDLL(curPath+"/boxtracking/libboxtracking.so")
+		# ---- Windows
+		elif os.name == 'nt':
+			trackingLib = ctypes.CDLL(curPath+"/boxtracking/libboxtracking.dll")
+	except OSError, e:
+		print e
+		trackingLib = None
 
 
 	if trackingLib != None:
@@ -1303,6 +2063,100 @@ def main():
 	print trackingLib
 
 
+# Comma separated list of object ids, returned sorted and without
+# duplicates, so that no object is propagated twice
+def objectIdList(s):
+	try:
+		return sorted(set([int(x) for x in s.split(",")]))
+	except ValueError:
+		raise argparse.ArgumentTypeError("expected comma separated object ids, got "+s)
+
+
+# Propagation over a range of frames without the GUI:
+# actanno.py propagate <folder> --from F --to T [--objects ID,...] [--keyframes] [--jobs N]
+def propagateMain(curPath, argv):
+	parser = argparse.ArgumentParser(prog=sys.argv[0]+" propagate",
+		description="Propagate the boxes of a frame over a range of frames without the GUI, and save the annotation.")
+	parser.add_argument("folder", help="sequence folder, holding config.yml")
+	parser.add_argument("--from", dest="first", type=int, required=True, help="frame holding the boxes to propagate (the first frame is 1)")
+	parser.add_argument("--to", dest="last", type=int, required=True, help="last frame to propagate the boxes to")
+	parser.add_argument("--objects", type=objectIdList, default=None, help="comma separated ids of the objects to propagate (default: all objects of the --from frame)")
+	parser.add_argument("--keyframes", action="store_true", help="keep the boxes already in the range: each one is propagated up to the next box of its object")
+	parser.add_argument("--jobs", type=int, default=1, help="number of processes tracking objects and segments between keyframes in parallel")
+	args = parser.parse_args(argv)
+
+	loadConfig(args.folder)
+	loadTrackingLib(curPath)
+	ct = AAControler(interactive=False)
+	nframes = len(ct.filenames)
+	for nr in (args.first, args.last):
+		if nr < 1 or nr > nframes:
+			parser.error("frame %d is out of the range 1-%d" % (nr, nframes))
+
+	t = time.time()
+	try:
+		if args.jobs > 1 or args.keyframes:
+			n = ct.propagateParallel(args.first-1, args.last-1, args.objects, args.keyframes, args.jobs)
+			print "Propagated", n, "boxes in %.1f s" % (time.time()-t)
+		else:
+			n = ct.propagateRange(args.first-1, args.last-1, args.objects)
+			print "Propagated over", n, "frames in %.1f s" % (time.time()-t)
+		ct.exportXML()
+		print "Saved", ct.outputfilename
+	finally:
+		if trackingLib != None:
+			trackingLib.close_lib()
+		if ct.readAhead != None:
+			ct.readAhead.close()
+
+
+# Interpolation of the boxes between keyframes without the GUI:
+# actanno.py interpolate <folder> [--objects ID,...] [--refine]
+def interpolateMain(curPath, argv):
+	parser = argparse.ArgumentParser(prog=sys.argv[0]+" interpolate",
+		description="Fill the frames between the boxes of each object by linear interpolation, and save the annotation.")
+	parser.add_argument("folder", help="sequence folder, holding config.yml")
+	parser.add_argument("--objects", type=objectIdList, default=None, help="comma separated ids of the objects to interpolate (default: all objects)")
+	parser.add_argument("--refine", action="store_true", help="replace the interpolated boxes which do not match the images by the tracker result")
+	args = parser.parse_args(argv)
+
+	loadConfig(args.folder)
+	refine = args.refine or cfg.INTERPOLATE_REFINE
+	if refine:
+		loadTrackingLib(curPath)
+	ct = AAControler(interactive=False)
+	t = time.time()
+	try:
+		n = ct.interpolate(args.objects, refine)
+		print "Interpolated", n, "boxes in %.2f s" % (time.time()-t)
+		ct.exportXML()
+		print "Saved", ct.outputfilename
+	finally:
+		if trackingLib != None:
+			trackingLib.close_lib()
+		if ct.readAhead != None:
+			ct.readAhead.close()
+
+
+def main():
+	curPath=sys.path[0]
+
+	global classnames
+	global trackingLib
+	#print "Script installed at: ",curPath
+
+	if len(sys.argv) > 1 and sys.argv[1] == "propagate":
+		propagateMain(curPath, sys.argv[2:])
+		return
+	if len(sys.argv) > 1 and sys.argv[1] == "interpolate":
+		interpolateMain(curPath, sys.argv[2:])
+		return
+
+	folder_path = sys.argv[1]
+	loadConfig(folder_path)
+	loadTrackingLib(curPath)
+
+
 	root = Tk()
 	root.protocol("WM_DELETE_WINDOW", onexit)
 	global ex
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Columnar annotation store for actanno
+
+All bounding boxes of a video are kept in a single (n,5) int32 array with
+the columns x1, y1, x2, y2, objectId, sorted by frame. offsets[f] is the
+index of the first box of frame f, so the boxes of frame f are the rows
+offsets[f]:offsets[f+1].
+
+Frames which are edited are "checked out": their boxes are turned into a
+Python list of rectangle objects, which the GUI and the propagation code
+modify in place. The checked out lists are merged back into the arrays by
+flush(), in a single pass, before any whole-video operation and whenever
+too many frames are checked out.
+*****************************************************************************
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+X1, Y1, X2, Y2, OBJECTID = range(5)
+NCOLUMNS = 5
+
+# Number of checked out frames which triggers a flush
+MAX_CHECKED_OUT = 64
+# Number of most recently checked out frames kept as lists by this flush
+KEEP_CHECKED_OUT = 2
+
+
+class RectList(list):
+	"""The list of rectangles of a checked out frame. version is increased
+	   by every change of the list, so that data derived from the list
+	   (e.g. a hit-testing index) can be rebuilt when it is outdated. The
+	   rectangles themselves are replaced rather than modified in place."""
+
+	version = 0
+
+	def __setitem__(self, i, r):
+		list.__setitem__(self, i, r)
+		self.version += 1
+
+	def __delitem__(self, i):
+		list.__delitem__(self, i)
+		self.version += 1
+
+	def __setslice__(self, i, j, rects):
+		list.__setslice__(self, i, j, rects)
+		self.version += 1
+
+	def __delslice__(self, i, j):
+		list.__delslice__(self, i, j)
+		self.version += 1
+
+	def __iadd__(self, rects):
+		self.version += 1
+		return list.__iadd__(self, rects)
+
+	def append(self, r):
+		list.append(self, r)
+		self.version += 1
+
+	def extend(self, rects):
+		list.extend(self, rects)
+		self.version += 1
+
+	def insert(self, i, r):
+		list.insert(self, i, r)
+		self.version += 1
+
+	def pop(self, *args):
+		self.version += 1
+		return list.pop(self, *args)
+
+	def remove(self, r):
+		list.remove(self, r)
+		self.version += 1
+
+	def reverse(self):
+		list.reverse(self)
+		self.version += 1
+
+	def sort(self, *args, **kwargs):
+		list.sort(self, *args, **kwargs)
+		self.version += 1
+
+
+# Convert a list of rectangles to an (n,5) int32 array
+def rectsToArray(rects):
+	a = np.array([(r.x1, r.y1, r.x2, r.y2, r.objectId) for r in rects], dtype=np.int32)
+	return a.reshape(len(rects), NCOLUMNS)
+
+
+class AAStore:
+	"""The bounding boxes of all frames of a video. rectClass is called with
+	   (x1, y1, x2, y2, objectId) to create the rectangles of checked out
+	   frames."""
+
+	def __init__(self, nframes, rectClass):
+		self.rectClass = rectClass
+		self.data = np.zeros((0, NCOLUMNS), dtype=np.int32)
+		self.offsets = np.zeros(nframes+1, dtype=np.int64)
+		# frame number -> list of rectangles, in check out order
+		self.checkedOut = OrderedDict()
+
+	def __len__(self):
+		self.flush(False)
+		return len(self.data)
+
+	def nframes(self):
+		return len(self.offsets)-1
+
+	# Return the (checked out) list of rectangles of a frame
+	def frameRects(self, nr):
+		rects = self.checkedOut.get(nr)
+		if rects is None:
+			if len(self.checkedOut) >= MAX_CHECKED_OUT:
+				self.flush(True)
+			rc = self.rectClass
+			rows = self.data[self.offsets[nr]:self.offsets[nr+1]].tolist()
+			rects = RectList([rc(r[0], r[1], r[2], r[3], r[4]) for r in rows])
+			self.checkedOut[nr] = rects
+		return rects
+
+	# Replace the rectangles of a frame by the given list
+	def setFrameRects(self, nr, rects):
+		self.checkedOut.pop(nr, None)
+		self.checkedOut[nr] = RectList(rects)
+
+	# Number of rectangles of a frame, without checking it out
+	def frameCount(self, nr):
+		rects = self.checkedOut.get(nr)
+		if rects is not None:
+			return len(rects)
+		return int(self.offsets[nr+1]-self.offsets[nr])
+
+	# Merge the checked out frames back into the arrays. If drop is set,
+	# only the most recently checked out frames stay checked out; lists of
+	# the other frames must not be modified anymore.
+	def flush(self, drop):
+		if len(self.checkedOut) < 1:
+			return
+		counts = np.diff(self.offsets)
+		dirty = sorted(self.checkedOut.keys())
+		arrays = {}
+		for nr in dirty:
+			arrays[nr] = rectsToArray(self.checkedOut[nr])
+			counts[nr] = len(arrays[nr])
+		offsets = np.zeros(len(self.offsets), dtype=np.int64)
+		np.cumsum(counts, out=offsets[1:])
+		data = np.empty((offsets[-1], NCOLUMNS), dtype=np.int32)
+
+		# copy the unchanged runs of frames between the checked out ones
+		prev = 0
+		for nr in dirty:
+			data[offsets[prev]:offsets[nr]] = self.data[self.offsets[prev]:self.offsets[nr]]
+			data[offsets[nr]:offsets[nr+1]] = arrays[nr]
+			prev = nr+1
+		data[offsets[prev]:] = self.data[self.offsets[prev]:]
+
+		self.data = data
+		self.offsets = offsets
+		if drop:
+			while len(self.checkedOut) > KEEP_CHECKED_OUT:
+				self.checkedOut.popitem(last=False)
+
+	# Add boxes to the store: framecol holds the frame number of each row
+	# of data. Boxes keep their order within a frame, after the existing ones.
+	def load(self, framecol, data):
+		self.flush(False)
+		framecol = np.concatenate((self.frameColumn(), np.asarray(framecol, dtype=np.int64)))
+		data = np.concatenate((self.data, np.asarray(data, dtype=np.int32).reshape(-1, NCOLUMNS)))
+		order = np.argsort(framecol, kind="mergesort")
+		self.data = data[order]
+		counts = np.bincount(framecol, minlength=self.nframes())
+		self.offsets = np.zeros(len(self.offsets), dtype=np.int64)
+		np.cumsum(counts, out=self.offsets[1:])
+		# checked out lists do not know about the new boxes anymore
+		self.checkedOut.clear()
+
+	# The frame number of each row of the arrays
+	def frameColumn(self):
+		return np.repeat(np.arange(self.nframes(), dtype=np.int64), np.diff(self.offsets))
+
+	# Return (data, framecol) for whole-video operations, after a flush
+	def columns(self):
+		self.flush(False)
+		return self.data, self.frameColumn()
+
+	# The rows of the boxes which use an objectId already used by an
+	# earlier box of the same frame, in row order
+	def duplicates(self):
+		data, framecol = self.columns()
+		if len(data) < 2:
+			return np.zeros(0, dtype=np.int64)
+		ids = data[:, OBJECTID].astype(np.int64)
+		key = framecol*(int(ids.max())-int(ids.min())+1)+(ids-ids.min())
+		order = np.argsort(key, kind="mergesort")
+		same = key[order][1:] == key[order][:-1]
+		return np.sort(order[1:][same])
+
+	# The rows of the boxes of each object: a list of (objectId, rows),
+	# sorted by objectId, the rows being in frame order
+	def objects(self):
+		data, framecol = self.columns()
+		ids = data[:, OBJECTID]
+		order = np.argsort(ids, kind="mergesort")
+		sortedIds = ids[order]
+		bounds = np.flatnonzero(np.diff(sortedIds))+1
+		starts = np.concatenate(([0], bounds))
+		ends = np.concatenate((bounds, [len(order)]))
+		return [(int(sortedIds[s]), order[s:e]) for (s, e) in zip(starts, ends) if e > s]
+
+	# Linear interpolation of the boxes of each object (all objects, or the
+	# given objectIds) over the frames between two frames where it has a
+	# box. Gaps longer than maxGap frames are left empty (0: no limit).
+	# Return (framecol, data) for the new boxes, sorted by objectId and
+	# frame, without adding them to the store.
+	def interpolate(self, objectIds=None, maxGap=0):
+		data, framecol = self.columns()
+		ids = data[:, OBJECTID]
+		rows = np.arange(len(data))
+		if objectIds is not None:
+			rows = rows[np.in1d(ids, objectIds)]
+		order = rows[np.lexsort((framecol[rows], ids[rows]))]
+		a = order[:-1]
+		b = order[1:]
+		gap = framecol[b]-framecol[a]
+		sel = (ids[a] == ids[b]) & (gap > 1)
+		if maxGap > 0:
+			sel &= gap <= maxGap
+		a, b, gap = a[sel], b[sel], gap[sel]
+
+		# k-th missing frame of each gap, for k = 1..gap-1
+		counts = gap-1
+		pair = np.repeat(np.arange(len(a)), counts)
+		k = np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)+1
+		t = (k/gap[pair].astype(np.float64))[:, np.newaxis]
+		start = data[a[pair], X1:Y2+1].astype(np.float64)
+		end = data[b[pair], X1:Y2+1].astype(np.float64)
+		boxes = np.rint(start+t*(end-start)).astype(np.int32)
+		newdata = np.column_stack((boxes, ids[a[pair]])).astype(np.int32).reshape(-1, NCOLUMNS)
+		return framecol[a[pair]]+k, newdata
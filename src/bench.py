@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Benchmarks for actanno
+
+usage: python bench.py <benchmark> [<benchmark> ...]
+       python bench.py           (lists the benchmarks)
+
+The benchmarks work on synthetic annotations and do not need any image
+files.
+*****************************************************************************
+"""
+
+import os
+import sys
+import copy
+import time
+import tempfile
+
+import numpy as np
+
+from actanno import AAControler, AAFrame, AARect, copyRects
+from actanno import CORNER_DIST_THR, CENTER_DIST_THR
+from annostore import AAStore
+from hittest import GridIndex, ArrayIndex
+from tracking import NCCTracker
+
+
+class BenchControler(AAControler):
+	"""A controler holding a synthetic annotation: nobjects objects with
+	   rectsPerFrame boxes in each of nframes frames"""
+
+	def __init__(self, nframes, nobjects, rectsPerFrame, seed=0):
+		rnd = np.random.RandomState(seed)
+		n = nframes*rectsPerFrame
+		self.filenames = ["frame-%06d.jpg" % i for i in range(nframes)]
+		self.videoname = "bench"
+		self.ClassAssignations = [1]*nobjects
+		self.curFrameNr = 0
+		self.journal = None
+		self.store = AAStore(nframes, AARect)
+		self.frames = [AAFrame(self.store, i) for i in range(nframes)]
+		x = rnd.randint(0, 1800, n)
+		y = rnd.randint(0, 1000, n)
+		boxes = np.column_stack((x, y, x+rnd.randint(10, 120, n), y+rnd.randint(10, 80, n), rnd.randint(1, nobjects+1, n)))
+		self.store.load(np.repeat(np.arange(nframes), rectsPerFrame), boxes)
+
+
+# Best wall clock time of repeat calls of f
+def timeit(f, repeat=3):
+	best = None
+	for i in range(repeat):
+		t = time.time()
+		f()
+		t = time.time()-t
+		if best is None or t < best:
+			best = t
+	return best
+
+
+# XML export time for growing videos: the time per box should stay constant
+def benchExport():
+	fd, filename = tempfile.mkstemp(suffix=".xml")
+	os.close(fd)
+	print "%8s %8s %10s %12s" % ("frames", "boxes", "time (s)", "us per box")
+	for nframes in (1000, 2000, 4000, 8000, 16000):
+		ct = BenchControler(nframes, 200, 10)
+		t = timeit(lambda: ct.exportXMLFilename(filename))
+		nboxes = nframes*10
+		print "%8d %8d %10.3f %12.2f" % (nframes, nboxes, t, 1e6*t/nboxes)
+	os.remove(filename)
+
+
+class DictRect:
+	"""AARect as it was before __slots__, for comparison"""
+	def __init__(self, x1, y1, x2, y2, objectId):
+		self.x1 = x1
+		self.y1 = y1
+		self.x2 = x2
+		self.y2 = y2
+		self.objectId = objectId
+
+
+# Bytes used by a rectangle object and its attribute dictionary (the
+# integers are not counted, they are the same for all representations)
+def rectBytes(r):
+	n = sys.getsizeof(r)
+	if hasattr(r, "__dict__"):
+		n += sys.getsizeof(r.__dict__)
+	return n
+
+
+# Memory per box of a synthetic video with 1M boxes, as Python objects with
+# and without __slots__ and as columns of the store, and time of copying
+# the boxes of a frame with copy.deepcopy and with copyRects
+def benchMemory():
+	nframes, perFrame = 20000, 50
+	ct = BenchControler(nframes, 200, perFrame)
+	data = ct.store.data
+	row = data[0].tolist()
+	print "%d boxes" % len(data)
+	print "%-22s %8s %10s" % ("representation", "B/box", "MB total")
+	# +8: the pointer in the list of rectangles of the frame
+	for name, n in (("object with __dict__", rectBytes(DictRect(*row))+8),
+			("object with __slots__", rectBytes(AARect(*row))+8),
+			("store columns", data.nbytes/float(len(data)))):
+		print "%-22s %8.1f %10.1f" % (name, n, n*len(data)/1048576.)
+
+	rects = ct.frames[0].rects
+	t1 = timeit(lambda: [copy.deepcopy(rects) for i in range(1000)])
+	t2 = timeit(lambda: [copyRects(rects) for i in range(1000)])
+	print "copy of a frame of %d boxes: deepcopy %.1f us, copyRects %.1f us" % (perFrame, 1000*t1, 1000*t2)
+
+
+# Random boxes on a 1920x1080 frame, and mouse positions: half of them
+# next to a corner, half of them anywhere
+def randomFrame(nboxes, nqueries, seed=0):
+	rnd = np.random.RandomState(seed)
+	f = AAFrame()
+	for k in range(nboxes):
+		x = rnd.randint(0, 1800)
+		y = rnd.randint(0, 1000)
+		f.rects.append(AARect(x, y, x+rnd.randint(10, 120), y+rnd.randint(10, 80), k+1))
+	queries = []
+	for q in range(nqueries):
+		if q % 2 == 0 and nboxes > 0:
+			r = f.rects[rnd.randint(0, nboxes)]
+			queries.append((r.x1+rnd.randint(-6, 7), r.y2+rnd.randint(-6, 7)))
+		else:
+			queries.append((rnd.randint(0, 1920), rnd.randint(0, 1080)))
+	return f, queries
+
+
+# Hit-testing with a scan of all rectangles, with the grid index and with
+# the NumPy arrays, for growing numbers of rectangles per frame: time per
+# query, and time to build each index (once per change of the frame)
+def benchHitTest():
+	print "%6s %10s %10s %10s %12s %12s" % ("boxes", "scan (us)", "grid (us)", "numpy (us)",
+		"grid build", "numpy build")
+	for nboxes in (10, 30, 100, 300, 1000):
+		f, queries = randomFrame(nboxes, 2000)
+		for (x, y) in queries:
+			a = f.getSemMousePosScan(x, y)
+			b = f.getSemMousePosGrid(x, y)
+			c = f.getSemMousePosArray(x, y)
+			assert (a.index, a.sempos) == (b.index, b.sempos) == (c.index, c.sempos), (x, y)
+		n = float(len(queries))
+		tScan = timeit(lambda: [f.getSemMousePosScan(x, y) for (x, y) in queries])/n
+		f.getSemMousePosGrid(0, 0)
+		tGrid = timeit(lambda: [f.getSemMousePosGrid(x, y) for (x, y) in queries])/n
+		f.getSemMousePosArray(0, 0)
+		tArray = timeit(lambda: [f.getSemMousePosArray(x, y) for (x, y) in queries])/n
+		tGridBuild = timeit(lambda: GridIndex(f.rects, CORNER_DIST_THR, CENTER_DIST_THR))
+		tArrayBuild = timeit(lambda: ArrayIndex(f.rects, CORNER_DIST_THR, CENTER_DIST_THR))
+		print "%6d %10.1f %10.1f %10.1f %12.1f %12.1f" % (nboxes, 1e6*tScan, 1e6*tGrid, 1e6*tArray,
+			1e6*tGridBuild, 1e6*tArrayBuild)
+
+
+# A smooth random 640x480 RGB frame, and the same scene moved by (dx,dy)
+def movedFrames(dx, dy, seed=0):
+	rnd = np.random.RandomState(seed)
+	big = rnd.randint(0, 256, (480+2*32, 640+2*32, 3)).astype(np.float32)
+	for i in range(3):
+		big = 0.25*(np.roll(big, 1, 0)+np.roll(big, -1, 0)+np.roll(big, 1, 1)+np.roll(big, -1, 1))
+	big = big.astype(np.uint8)
+	old = big[32:32+480, 32:32+640].copy()
+	new = big[32-dy:32+480-dy, 32-dx:32+640-dx].copy()
+	return old, new
+
+
+# Latency of the numpy tracker per box, for several box sizes and numbers
+# of pyramid levels, and its error on a known motion of (7,-5) pixels. The
+# pyramids are built once per frame, their time is given separately.
+def benchTracker():
+	old, new = movedFrames(7, -5)
+	rnd = np.random.RandomState(0)
+	print "%6s %7s %10s %10s %14s" % ("box", "levels", "ms/box", "error", "pyramids (ms)")
+	for size in (32, 64, 128):
+		rects = []
+		for i in range(20):
+			x = rnd.randint(40, 640-40-size)
+			y = rnd.randint(40, 480-40-size)
+			rects.append(AARect(x, y, x+size-1, y+size-1, i+1))
+		for levels in (0, 1, 2):
+			tracker = NCCTracker(16, levels)
+			tPyr = timeit(lambda: (NCCTracker(16, levels).pyramid(old), NCCTracker(16, levels).pyramid(new)))
+			out = tracker.trackRects(old, new, rects)
+			t = timeit(lambda: tracker.trackRects(old, new, rects))/len(rects)
+			err = max([max(abs(o.x1-r.x1-7), abs(o.y1-r.y1+5)) for (o, r) in zip(out, rects)])
+			print "%6d %7d %10.2f %10d %14.1f" % (size, levels, 1e3*t, err, 1e3*tPyr)
+
+
+BENCHMARKS = {
+	"export": benchExport,
+	"memory": benchMemory,
+	"hittest": benchHitTest,
+	"tracker": benchTracker,
+}
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print "usage:", sys.argv[0], "<benchmark> [<benchmark> ...]"
+		print "benchmarks:", " ".join(sorted(BENCHMARKS.keys()))
+		sys.exit(1)
+	for name in sys.argv[1:]:
+		print "---", name
+		BENCHMARKS[name]()
@@ -75,6 +75,22 @@ extern "C" int track_block_matching( const IplImage *im1, const IplImage *im2,
 	return tracker->track_block_matching( im1, im2, inrect, outrect);	
 }
 
+// Track n rectangles from im1 to im2: outrects[i] is the tracked inrects[i]
+extern "C" int track_block_matching_batch( const IplImage *im1, const IplImage *im2, 
+	const struct c_AARect *inrects, struct c_AARect *outrects, int n)
+{
+	if( tracker == NULL )
+		return -1;
+	
+	for (int i=0; i<n; i++)
+	{
+		int iRet = tracker->track_block_matching( im1, im2, inrects+i, outrects+i);
+		if (iRet != 0)
+			return iRet;
+	}
+	return 0;
+}
+
 extern "C" int track_histogram_matching( const IplImage *im1, const IplImage *im2, 
 	const struct c_AARect *inrect, struct c_AARect *outrect)
 {
@@ -34,6 +34,79 @@ __C.FOLDER_NAME = "default"
 __C.DATASET_NAME = "default"
 __C.OWNER = "default"
 
+# Memory budget (in MB) of the decoded frame cache, 0 disables it
+__C.FRAME_CACHE_MB = 512
+# Number of threads decoding frames in advance, 0 disables read-ahead
+__C.READ_AHEAD_THREADS = 2
+# Number of frames decoded in advance in the direction of travel
+__C.READ_AHEAD_FRAMES = 4
+# Maximum timestamp difference between an rgb frame and its matched depth
+# frame; pairs further apart are reported at startup (-1: no limit)
+__C.DEPTH_MAX_SKEW = -1
+# Keep the frame lists in an index file next to the XML file
+__C.FRAME_INDEX = True
+# Journal of the changes since the last save, used for crash recovery.
+# It is kept next to the XML file, as <XML file name>.save.journal, with
+# the backup XML <XML file name>.save.xml.
+__C.JOURNAL_FILE = "save.journal"
+# Number of journal records after which the full annotation is written
+# to the backup XML and the journal is restarted
+__C.JOURNAL_COMPACT = 1000
+# Hit-testing of the rectangles under the mouse: "scan", "grid" or "numpy"
+# (python bench.py hittest compares them)
+__C.HIT_TEST = "grid"
+# Tracking engine of the propagation: "jm" (JM tracking library), "ncc"
+# (numpy block matching), "lk" (Lucas-Kanade optical flow), "tm" (OpenCV
+# template matching), "copy" (no tracking) or "auto" (jm if the library is
+# loaded, ncc otherwise). lk and tm need the OpenCV 1.x libraries. See
+# tracking.py.
+__C.TRACKER = "auto"
+# Largest motion of a box between two frames searched by the ncc and tm
+# engines, in pixels
+__C.TRACKER_SEARCH = 16
+# Number of pyramid levels of the ncc, lk and tm engines (0: full
+# resolution only)
+__C.TRACKER_LEVELS = 2
+# Largest number of features followed in each box by the lk engine
+__C.TRACKER_FEATURES = 40
+# Number of frames decoded at a time in memory by the propagation on
+# several processes (actanno.py propagate --jobs/--keyframes)
+__C.PROPAGATE_WINDOW = 200
+# Interpolation of the boxes between keyframes (key i, or actanno.py
+# interpolate): gaps longer than this number of frames are not filled
+# (0: no limit)
+__C.INTERPOLATE_MAX_GAP = 0
+# Check the interpolated boxes against the images, and replace those
+# which do not look like the box of the previous frame by the tracker
+__C.INTERPOLATE_REFINE = False
+# Lowest appearance similarity (normalized cross-correlation, -1 to 1) of
+# an interpolated box with the box of the previous frame, below which it
+# is refined by the tracker
+__C.INTERPOLATE_MIN_NCC = 0.6
+# Raw values of the depth PNG files shown as black and white (for 16 bit
+# depth in millimeters, e.g. 500 and 8000); DEPTH_FAR 0 maps 0 to black
+# and the largest value of each frame to white
+__C.DEPTH_NEAR = 0
+__C.DEPTH_FAR = 0
+# Colors of the depth frames: "gray", "jet" (near in blue, far in red) or
+# "hot"; with a fixed range the color of a depth value does not change
+# from a frame to the next
+__C.DEPTH_COLORMAP = "gray"
+# Blended view of the rgb and depth frames (key b): "alpha" mixes them,
+# "side" shows them next to each other
+__C.DEPTH_BLEND = "alpha"
+# Initial weight of the depth frame in the "alpha" view (keys + and -)
+__C.DEPTH_BLEND_ALPHA = 0.5
+# Size of the displayed frames relative to the image files (e.g. 0.5 for
+# 4K footage on a full HD screen), 0 to fit the frames to the screen. The
+# annotations are always saved in the coordinates of the files.
+__C.DISPLAY_SCALE = 0.
+# Largest zoom of the view (mouse wheel, z and Z), in screen pixels per
+# pixel of the image files
+__C.ZOOM_MAX = 8.
+# Number of rendered tiles of 256x256 pixels kept for the zoomed views
+__C.VIEW_TILES = 256
+
 def _merge_a_into_b(a, b):
     """Merge config dictionary a into config dictionary b, clobbering the
     options in b whenever they are also specified in a.
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Depth frames for actanno
+
+Depth maps are 8 or 16 bit PNG files. They are read as integer arrays,
+without any conversion to floating point, and mapped to displayable 8 bit
+values by a lookup table indexed by the raw depth values. The mapped range
+is either fixed (near and far raw values from the configuration) or the
+range from 0 to the largest value of each frame.
+
+With a colormap other than gray, the lookup table gives the RGB color of
+each raw value directly, so that colorizing a frame is a single indexing
+operation. The raw value 0 (no measurement) is shown in black.
+
+blendFrames mixes an rgb frame with its depth frame in 8.8 fixed point.
+*****************************************************************************
+"""
+
+import numpy as np
+from PIL import Image
+
+# Displayed value of the far end of the range
+DEPTH_WHITE = 254
+# Largest number of lookup tables kept
+MAX_LUTS = 16
+
+# (maxval, near, far, colormap) -> lookup table
+_luts = {}
+
+
+# Colormaps: x in [0,1] (n values) -> (n,3) RGB in [0,1]
+def gray(x):
+	return np.column_stack((x, x, x))
+
+def jet(x):
+	return np.column_stack((1.5-np.abs(4*x-3), 1.5-np.abs(4*x-2), 1.5-np.abs(4*x-1)))
+
+def hot(x):
+	return np.column_stack((3*x, 3*x-1, 3*x-2))
+
+COLORMAPS = {
+	"gray": gray,
+	"jet": jet,
+	"hot": hot,
+}
+
+
+# The (DEPTH_WHITE+1,3) uint8 RGB colors of the displayed values
+def palette(colormap):
+	if colormap not in COLORMAPS:
+		raise ValueError("unknown depth colormap '%s' (%s)" % (colormap, ", ".join(sorted(COLORMAPS.keys()))))
+	x = np.arange(DEPTH_WHITE+1)/float(DEPTH_WHITE)
+	return np.rint(255*np.clip(COLORMAPS[colormap](x), 0, 1)).astype(np.uint8)
+
+
+# Read a PNG depth map as an integer array. Return (array, maxval), maxval
+# being the largest value of the bit depth of the file (255 or 65535).
+def readDepthPNG(path):
+	img = Image.open(path)
+	img.load()
+	if img.mode == "L":
+		return np.asarray(img), 255
+	if img.mode == "I" or img.mode.startswith("I;16"):
+		# PIL opens 16 bit PNG files in mode "I" (int32)
+		return np.asarray(img), 65535
+	# color or palette files: the channels are scaled like a gray image
+	if img.mode != "RGB":
+		img = img.convert("RGB")
+	return np.asarray(img), 255
+
+
+# The lookup table mapping the raw values 0..maxval to 0..DEPTH_WHITE, near
+# and below giving 0 and far and above giving DEPTH_WHITE. For colormaps
+# other than gray, the table maps the raw values to (maxval+1,3) colors.
+def depthLUT(maxval, near, far, colormap="gray"):
+	key = (maxval, near, far, colormap)
+	lut = _luts.get(key)
+	if lut is None:
+		if far <= near:
+			lut = np.zeros(maxval+1, dtype=np.uint8)
+		else:
+			v = np.arange(maxval+1, dtype=np.int64)-near
+			lut = np.clip(v*DEPTH_WHITE // (far-near), 0, DEPTH_WHITE).astype(np.uint8)
+		if colormap != "gray":
+			lut = palette(colormap)[lut]
+			lut[0] = 0
+		if len(_luts) >= MAX_LUTS:
+			_luts.clear()
+		_luts[key] = lut
+	return lut
+
+
+# Build the lookup tables of a fixed range for 8 and 16 bit files, so that
+# the first frames shown do not wait for them
+def prepareDepthLUTs(near, far, colormap="gray"):
+	palette(colormap)
+	if far > 0:
+		for maxval in (255, 65535):
+			depthLUT(maxval, near, far, colormap)
+
+
+# Read and decode a PNG depth map into an RGB PIL image. near and far are
+# the raw depth values mapped to the ends of the colormap; if far is 0, the
+# range goes from 0 to the largest value of the frame.
+def decodeDepthImage(path, near=0, far=0, colormap="gray"):
+	arr, maxval = readDepthPNG(path)
+	if far <= 0:
+		near, far = 0, int(arr.max())
+	if arr.ndim == 3:
+		# color files are only scaled
+		colormap = "gray"
+	lut = depthLUT(maxval, near, far, colormap)
+	# mode clip: 16 bit files read as int32 cannot index outside the table
+	out = np.take(lut, arr, axis=0, mode="clip")
+	if out.ndim == 3:
+		return Image.fromarray(out, "RGB")
+	return Image.fromarray(out, "L").convert("RGB")
+
+
+# Mix two uint8 arrays of the same shape, alpha (0 to 1) being the weight
+# of depth, in 8.8 fixed point arithmetic
+def blendFrames(rgb, depth, alpha):
+	a = int(round(alpha*256))
+	out = np.multiply(depth, a, dtype=np.uint16)
+	out += np.multiply(rgb, 256-a, dtype=np.uint16)
+	out >>= 8
+	return out.astype(np.uint8)
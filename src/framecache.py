@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Frame cache for actanno
+
+Decoded frames (PIL images, or numpy arrays made from them) are kept in a bounded LRU cache keyed by
+(path, mode), so that stepping back and forth over the same frames does
+not re-open and re-decode the image files. A pool of read-ahead threads
+decodes the frames which will be needed next into the same cache.
+*****************************************************************************
+"""
+
+import threading
+import Queue
+from collections import OrderedDict
+
+
+# Number of bytes used by a decoded PIL image or a numpy array
+def imageBytes(img):
+	if hasattr(img, "nbytes"):
+		return img.nbytes
+	return img.size[0] * img.size[1] * len(img.getbands())
+
+
+class FrameCache:
+	"""A bounded LRU cache of decoded frames, keyed by (path, mode).
+	   The memory budget is given in megabytes; a budget of 0 disables
+	   the cache."""
+
+	def __init__(self, budgetMB):
+		self.budget = int(budgetMB) * 1024 * 1024
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.entries = OrderedDict()
+		# the cache is shared with the read-ahead threads
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, key):
+		with self.lock:
+			return key in self.entries
+
+	# Return the cached image for the given key, or None. A hit moves the
+	# entry to the most recently used end of the cache.
+	def get(self, key):
+		with self.lock:
+			img = self.entries.pop(key, None)
+			if img is None:
+				self.misses += 1
+				return None
+			self.entries[key] = img
+			self.hits += 1
+			return img
+
+	# Insert an image and evict the least recently used entries until the
+	# cache fits into its budget again
+	def put(self, key, img):
+		size = imageBytes(img)
+		if size > self.budget:
+			return
+		with self.lock:
+			old = self.entries.pop(key, None)
+			if old is not None:
+				self.nbytes -= imageBytes(old)
+			self.entries[key] = img
+			self.nbytes += size
+			while self.nbytes > self.budget:
+				k, evicted = self.entries.popitem(last=False)
+				self.nbytes -= imageBytes(evicted)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.nbytes = 0
+
+	def stats(self):
+		return "frame cache: %d hits, %d misses, %d frames, %.1f/%d MB" % (self.hits,
+			self.misses, len(self.entries), self.nbytes / 1048576., self.budget / 1048576)
+
+
+class ReadAhead:
+	"""A pool of threads decoding frames in the background into a FrameCache.
+	   decode is called with a cache key (path, mode) and returns a PIL
+	   image. Each call to
+	   schedule() replaces the previous requests: frames which were asked
+	   for earlier and are not decoded yet are dropped."""
+
+	def __init__(self, cache, decode, nthreads):
+		self.cache = cache
+		self.decode = decode
+		self.jobs = Queue.Queue()
+		self.lock = threading.Lock()
+		# key -> [event set when decoded, generation of the request]
+		self.pending = {}
+		self.generation = 0
+		self.threads = []
+		for i in range(nthreads):
+			t = threading.Thread(target=self.worker)
+			t.daemon = True
+			t.start()
+			self.threads.append(t)
+
+	# Stop the threads once the jobs already queued are done
+	def close(self):
+		for t in self.threads:
+			self.jobs.put(None)
+		for t in self.threads:
+			t.join()
+		self.threads = []
+
+	# Request the frames of the given keys to be decoded, in this order
+	def schedule(self, keys):
+		with self.lock:
+			self.generation += 1
+			for key in keys:
+				if key in self.pending:
+					self.pending[key][1] = self.generation
+				elif not key in self.cache:
+					self.pending[key] = [threading.Event(), self.generation]
+					self.jobs.put(key)
+
+	# Block until the given key is decoded, if it is currently scheduled
+	def wait(self, key):
+		with self.lock:
+			job = self.pending.get(key)
+		if job is not None:
+			job[0].wait()
+
+	def worker(self):
+		while True:
+			key = self.jobs.get()
+			if key is None:
+				break
+			with self.lock:
+				stale = self.pending[key][1] != self.generation
+			if not stale:
+				try:
+					self.cache.put(key, self.decode(key))
+				except Exception, e:
+					print "read-ahead: could not decode", key[0], ":", e
+			with self.lock:
+				job = self.pending.pop(key)
+			job[0].set()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Frame index for actanno
+
+Helpers parsing the frame file names (format numFrame-timestamp.ext)
+and matching every RGB frame with the depth frame closest in time.
+The result of the directory listing and of the matching is kept in a
+JSON sidecar file, so that reopening a sequence does not list and parse
+the frame directories again.
+*****************************************************************************
+"""
+
+import os
+import glob
+import json
+import numpy as np
+from PIL import Image
+
+# Bump this when the layout of the index file changes
+INDEX_VERSION = 1
+
+
+# Return the timestamp encoded in a frame file name
+def parseTimestamp(filename):
+	return int(filename.split("-")[-1].split(".")[0])
+
+
+# Parse the timestamps of a list of file names into an int64 array
+def parseTimestamps(filenames):
+	return np.array([parseTimestamp(f) for f in filenames], dtype=np.int64)
+
+# Return the frame number encoded in a frame file name, or -1
+def parseFrameNumber(filename):
+	try:
+		return int(os.path.basename(filename).split("-")[0].split("_")[0])
+	except ValueError:
+		return -1
+
+
+# For each timestamp in ts_rgb, find the index of the closest timestamp in
+# ts_depth (nearest neighbour search with searchsorted).
+# Return (indices, skews, mismatched): the index of the matched depth frame
+# for each RGB frame, the absolute time difference of the pair, and a
+# boolean mask of the pairs whose skew exceeds maxSkew (maxSkew<0 accepts
+# any skew).
+def matchTimestamps(ts_rgb, ts_depth, maxSkew=-1):
+	ts_rgb = np.asarray(ts_rgb, dtype=np.int64)
+	ts_depth = np.asarray(ts_depth, dtype=np.int64)
+	if len(ts_depth) < 1:
+		raise ValueError("no depth timestamps to match with")
+
+	# depth file names are not necessarily sorted by timestamp
+	order = np.argsort(ts_depth, kind="mergesort")
+	ts_sorted = ts_depth[order]
+
+	right = np.searchsorted(ts_sorted, ts_rgb)
+	right = np.clip(right, 0, len(ts_sorted)-1)
+	left = np.clip(right-1, 0, len(ts_sorted)-1)
+	dright = np.abs(ts_sorted[right]-ts_rgb)
+	dleft = np.abs(ts_sorted[left]-ts_rgb)
+	# on ties, prefer the later depth frame
+	best = np.where(dleft < dright, left, right)
+
+	indices = order[best]
+	skews = np.abs(ts_depth[indices]-ts_rgb)
+	if maxSkew < 0:
+		mismatched = np.zeros(len(ts_rgb), dtype=bool)
+	else:
+		mismatched = skews > maxSkew
+	return indices, skews, mismatched
+
+
+# Modification time of the directory holding the files with the given prefix
+def prefixMtime(prefix):
+	return os.stat(os.path.dirname(prefix) or ".").st_mtime
+
+
+class FrameIndex:
+	"""The sorted frame file names of a sequence, their frame numbers and
+	   timestamps, the image size and the rgb->depth mapping"""
+
+	def __init__(self):
+		self.prefix = ""
+		self.prefix_depth = ""
+		self.mtimes = []
+		self.filenames = []
+		self.frameNumbers = []
+		self.timestamps = []
+		self.size = None
+		self.filenames_depth = []
+		self.timestamps_depth = []
+		self.size_depth = None
+		self.rgb2depth = []
+
+	# List the frame directories. prefix_depth is empty for rgb only
+	# sequences. The rgb->depth mapping is left to the caller.
+	def build(self, prefix, prefix_depth):
+		self.prefix = prefix
+		self.prefix_depth = prefix_depth
+		self.mtimes = [prefixMtime(prefix)]
+		self.filenames = sorted(glob.glob(prefix+"*"))
+		self.frameNumbers = [parseFrameNumber(f) for f in self.filenames]
+		if len(self.filenames) > 0:
+			self.size = Image.open(self.filenames[0]).size
+		if prefix_depth:
+			self.mtimes.append(prefixMtime(prefix_depth))
+			self.filenames_depth = sorted(glob.glob(prefix_depth+"*"))
+			if len(self.filenames_depth) > 0:
+				self.size_depth = Image.open(self.filenames_depth[0]).size
+
+	# Is the index built for these prefixes and are the directories unchanged?
+	def isValid(self, prefix, prefix_depth):
+		if self.prefix != prefix or self.prefix_depth != prefix_depth:
+			return False
+		prefixes = [prefix, prefix_depth] if prefix_depth else [prefix]
+		try:
+			return self.mtimes == [prefixMtime(p) for p in prefixes]
+		except OSError:
+			return False
+
+	def save(self, filename):
+		d = dict(self.__dict__)
+		d["version"] = INDEX_VERSION
+		for k in ("timestamps", "timestamps_depth", "rgb2depth"):
+			d[k] = [int(x) for x in d[k]]
+		with open(filename, "w") as fd:
+			json.dump(d, fd, separators=(",", ":"))
+
+	# Return the index stored in the given file, or None if there is no
+	# such file or it is outdated
+	@staticmethod
+	def load(filename, prefix, prefix_depth):
+		try:
+			with open(filename) as fd:
+				d = json.load(fd)
+		except (IOError, ValueError):
+			return None
+		if d.pop("version", None) != INDEX_VERSION:
+			return None
+		index = FrameIndex()
+		for k, v in d.items():
+			setattr(index, str(k), v)
+		# json returns unicode strings
+		index.prefix = index.prefix.encode("utf-8")
+		index.prefix_depth = index.prefix_depth.encode("utf-8")
+		index.filenames = [f.encode("utf-8") for f in index.filenames]
+		index.filenames_depth = [f.encode("utf-8") for f in index.filenames_depth]
+		if index.size is not None:
+			index.size = tuple(index.size)
+		if index.size_depth is not None:
+			index.size_depth = tuple(index.size_depth)
+		if not index.isValid(prefix, prefix_depth):
+			return None
+		index.timestamps = np.array(index.timestamps, dtype=np.int64)
+		index.timestamps_depth = np.array(index.timestamps_depth, dtype=np.int64)
+		index.rgb2depth = np.array(index.rgb2depth, dtype=np.int64)
+		return index
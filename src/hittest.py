@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Hit-testing for actanno
+
+Finds the rectangle corner or center nearest to the mouse cursor, with
+the semantics of AAFrame.getSemMousePos: the nearest corner wins if it is
+closer than the corner threshold, otherwise the nearest center is
+returned, as "c" if it is closer than the center threshold and as "g"
+otherwise. Ties go to the first rectangle, and for corners of the same
+rectangle to the first corner in the order ul, ll, ur, lr.
+
+GridIndex answers these queries with uniform grids over the corners and
+the centers, so that a query only looks at the rectangles near the
+cursor instead of all the rectangles of the frame. ArrayIndex computes
+all the corner and center distances of the frame at once with NumPy.
+*****************************************************************************
+"""
+
+import math
+import numpy as np
+
+# Corner names, in tie-breaking order
+CORNERS = ("ul", "ll", "ur", "lr")
+
+
+class GridIndex:
+	"""Uniform grids over the corners and the centers of a list of
+	   rectangles. The corner grid has cells of the size of the corner
+	   threshold, so a corner within the threshold is always in the 3x3
+	   cells around the cursor. The nearest center is found by searching
+	   rings of cells of growing size around the cursor."""
+
+	def __init__(self, rects, cornerThr, centerThr):
+		self.n = len(rects)
+		self.cornerThr2 = cornerThr*cornerThr
+		self.centerThr2 = centerThr*centerThr
+		self.cornerCell = float(cornerThr)
+
+		# corner grid: cell -> list of (index, corner nr, x, y)
+		self.corners = {}
+		cs = self.cornerCell
+		for (i, r) in enumerate(rects):
+			for (k, (cx, cy)) in enumerate(((r.x1, r.y1), (r.x1, r.y2), (r.x2, r.y1), (r.x2, r.y2))):
+				cell = (int(math.floor(cx/cs)), int(math.floor(cy/cs)))
+				self.corners.setdefault(cell, []).append((i, k, cx, cy))
+
+		# center grid: cell -> list of (index, x, y)
+		self.centers = {}
+		if self.n < 1:
+			return
+		cxs = [0.5*(r.x1+r.x2) for r in rects]
+		cys = [0.5*(r.y1+r.y2) for r in rects]
+		minx, maxx, miny, maxy = min(cxs), max(cxs), min(cys), max(cys)
+		# about one center per cell
+		area = max(maxx-minx, 1.)*max(maxy-miny, 1.)
+		self.centerCell = max(float(centerThr), math.sqrt(area/self.n))
+		cs = self.centerCell
+		for i in range(self.n):
+			cell = (int(math.floor(cxs[i]/cs)), int(math.floor(cys[i]/cs)))
+			self.centers.setdefault(cell, []).append((i, cxs[i], cys[i]))
+		self.cellBounds = (int(math.floor(minx/cs)), int(math.floor(maxx/cs)),
+			int(math.floor(miny/cs)), int(math.floor(maxy/cs)))
+
+	# Return (index, sempos) for the mouse position x,y
+	def query(self, x, y):
+		if self.n < 1:
+			return (-1, "n")
+
+		# Corners within the threshold are in the 3x3 neighbouring cells
+		cs = self.cornerCell
+		qx = int(math.floor(x/cs))
+		qy = int(math.floor(y/cs))
+		best = None
+		for gx in (qx-1, qx, qx+1):
+			for gy in (qy-1, qy, qy+1):
+				for (i, k, cx, cy) in self.corners.get((gx, gy), ()):
+					d = (cx-x)*(cx-x)+(cy-y)*(cy-y)
+					if best is None or (d, i, k) < best:
+						best = (d, i, k)
+		if best is not None and best[0] < self.cornerThr2:
+			return (best[1], CORNERS[best[2]])
+
+		# Nearest center: search rings of cells around the cursor, starting
+		# at the first ring which meets the occupied cells. After ring r,
+		# all the centers not seen yet are at least r*cs away.
+		cs = self.centerCell
+		qx = int(math.floor(x/cs))
+		qy = int(math.floor(y/cs))
+		bx0, bx1, by0, by1 = self.cellBounds
+		r0 = max(bx0-qx, qx-bx1, by0-qy, qy-by1, 0)
+		rmax = max(abs(bx0-qx), abs(bx1-qx), abs(by0-qy), abs(by1-qy))
+		best = None
+		for r in range(r0, rmax+1):
+			for (gx, gy) in self.ring(qx, qy, r):
+				for (i, cx, cy) in self.centers.get((gx, gy), ()):
+					d = (cx-x)*(cx-x)+(cy-y)*(cy-y)
+					if best is None or (d, i) < best:
+						best = (d, i)
+			if best is not None and best[0] < (r*cs)*(r*cs):
+				break
+
+		if best[0] < self.centerThr2:
+			return (best[1], "c")
+		return (best[1], "g")
+
+	# The cells at Chebyshev distance r of cell (qx,qy), within the bounds
+	# of the occupied cells
+	def ring(self, qx, qy, r):
+		bx0, bx1, by0, by1 = self.cellBounds
+		if r == 0:
+			return [(qx, qy)]
+		cells = []
+		for gy in (qy-r, qy+r):
+			if by0 <= gy <= by1:
+				for gx in range(max(qx-r, bx0), min(qx+r, bx1)+1):
+					cells.append((gx, gy))
+		for gx in (qx-r, qx+r):
+			if bx0 <= gx <= bx1:
+				for gy in range(max(qy-r+1, by0), min(qy+r-1, by1)+1):
+					cells.append((gx, gy))
+		return cells
+
+
+class ArrayIndex:
+	"""The corners and centers of a list of rectangles as NumPy arrays.
+	   A query computes the distances to all of them in one expression."""
+
+	def __init__(self, rects, cornerThr, centerThr):
+		self.n = len(rects)
+		self.cornerThr2 = cornerThr*cornerThr
+		self.centerThr2 = centerThr*centerThr
+		b = np.array([(r.x1, r.y1, r.x2, r.y2) for r in rects], dtype=np.float64).reshape(self.n, 4)
+		# (n,4) corner coordinates, in the order ul, ll, ur, lr
+		self.cx = b[:, [0, 0, 2, 2]]
+		self.cy = b[:, [1, 3, 1, 3]]
+		self.mx = 0.5*(b[:, 0]+b[:, 2])
+		self.my = 0.5*(b[:, 1]+b[:, 3])
+
+	# Return (index, sempos) for the mouse position x,y
+	def query(self, x, y):
+		if self.n < 1:
+			return (-1, "n")
+		# argmin returns the first minimum in row major order, which is the
+		# tie-breaking order of the scan
+		d = (self.cx-x)**2+(self.cy-y)**2
+		k = int(np.argmin(d))
+		if d.flat[k] < self.cornerThr2:
+			return (k // 4, CORNERS[k % 4])
+		d = (self.mx-x)**2+(self.my-y)**2
+		i = int(np.argmin(d))
+		if d[i] < self.centerThr2:
+			return (i, "c")
+		return (i, "g")
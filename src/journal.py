@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Change journal for actanno
+
+An append-only log of the annotation changes made since the last full
+save. Each line is one record, made of a type and integer fields:
+
+  add   framenr x1 y1 x2 y2 objectId     append a rectangle to a frame
+  move  framenr RECT x1 y1 x2 y2         change the coordinates of a rectangle
+  del   framenr RECT                     delete a rectangle
+  clear framenr                          delete all rectangles of a frame
+  id    framenr RECT objectId            reassign the id of a rectangle
+  class objectId classnr                 assign a class to an object
+
+RECT is "objectId x1 y1 x2 y2", the rectangle before the change. The
+rectangles are identified by their contents rather than by their position
+in the frame, since the backup XML groups them by object and does not keep
+the order of the rectangles of a frame.
+
+The first line holds the name of the annotation file the journal belongs
+to. The records apply on top of the backup XML written when the journal
+was started, so that after a crash the annotation can be rebuilt by
+loading the backup and replaying the journal.
+*****************************************************************************
+"""
+
+import os
+
+HEADER = "actanno-journal"
+
+# Number of integer fields of each record type
+RECORD_FIELDS = {"add": 6, "move": 10, "del": 6, "clear": 1, "id": 7, "class": 2}
+
+
+class Journal:
+	"""The change journal of the annotation file target"""
+
+	def __init__(self, filename, target):
+		self.filename = filename
+		self.target = target
+		self.fd = None
+		# number of records written since the journal was started
+		self.count = 0
+
+	def isOpen(self):
+		return self.fd is not None
+
+	# Is there a journal left over for our annotation file?
+	def pending(self):
+		try:
+			with open(self.filename) as fd:
+				return fd.readline().rstrip("\n") == HEADER+" "+self.target
+		except IOError:
+			return False
+
+	# Start a new, empty journal
+	def start(self):
+		self.close()
+		self.fd = open(self.filename, "w")
+		self.fd.write(HEADER+" "+self.target+"\n")
+		self.fd.flush()
+		self.count = 0
+
+	# Continue writing to the existing journal
+	def resume(self):
+		self.close()
+		self.count = len(list(self.records()))
+		self.fd = open(self.filename, "a")
+
+	def record(self, rtype, *fields):
+		self.fd.write(rtype+" "+" ".join([str(int(f)) for f in fields])+"\n")
+		self.fd.flush()
+		self.count += 1
+
+	# Iterate over the records of the journal as (type, fields) tuples.
+	# A truncated last line (crash while writing) is ignored.
+	def records(self):
+		with open(self.filename) as fd:
+			fd.readline()
+			for line in fd:
+				if not line.endswith("\n"):
+					break
+				tokens = line.split()
+				if len(tokens) < 1 or RECORD_FIELDS.get(tokens[0]) != len(tokens)-1:
+					break
+				yield tokens[0], [int(t) for t in tokens[1:]]
+
+	def close(self):
+		if self.fd is not None:
+			self.fd.close()
+			self.fd = None
+
+	# Delete the journal, its changes are saved
+	def remove(self):
+		self.close()
+		self.count = 0
+		if os.path.isfile(self.filename):
+			os.remove(self.filename)
@@ -19,9 +19,11 @@ Changelog:
 """
 
 import ctypes
+import atexit
 import os
 import platform
 from ctypes.util import find_library
+import numpy as np
 
 
 ############################################################
@@ -311,5 +313,48 @@ def cvCreateImageFromPilImage(pilimage):
     return img
 
 
+############################################################
+
+# numpy arrays
 
+_numpy_dtype_to_ipl_depth = {
+    np.dtype(np.uint8): IPL_DEPTH_8U,
+    np.dtype(np.int8): IPL_DEPTH_8S,
+    np.dtype(np.uint16): IPL_DEPTH_16U,
+    np.dtype(np.int16): IPL_DEPTH_16S,
+    np.dtype(np.int32): IPL_DEPTH_32S,
+    np.dtype(np.float32): IPL_DEPTH_32F,
+    np.dtype(np.float64): IPL_DEPTH_64F,
+}
 
+# Image headers of cvImageFromArray, by (slot, width, height, depth, channels)
+_array_headers = {}
+# release them while the module is still alive
+atexit.register(_array_headers.clear)
+
+def cvImageFromArray(arr, slot=0):
+    """Wraps a C contiguous numpy array of shape (height, width) or
+    (height, width, channels) into an IplImage, without copying the data
+
+    The IplImage header is created once for each slot and image format,
+    and reused by the next calls with the same slot, which invalidates
+    the image returned by the previous call. Use different slots for
+    images needed at the same time. The image keeps the array alive.
+    The channels keep the order of the array (RGB for arrays made from
+    a PIL.Image), they are not swapped to BGR.
+    """
+    if arr.ndim not in (2, 3) or not arr.flags.c_contiguous:
+        raise TypeError("Can only convert C contiguous arrays of 2 or 3 dimensions.")
+    try:
+        depth = _numpy_dtype_to_ipl_depth[arr.dtype]
+    except KeyError:
+        raise TypeError("Don't know how to convert arrays of type %s." % arr.dtype)
+    nchannels = arr.shape[2] if arr.ndim == 3 else 1
+    key = (slot, arr.shape[1], arr.shape[0], depth, nchannels)
+    img = _array_headers.get(key)
+    if img is None:
+        img = cvCreateImageHeader(cvSize(arr.shape[1], arr.shape[0]), depth, nchannels)
+        _array_headers[key] = img
+    cvSetData(img, arr.ctypes.data, arr.strides[0])
+    img._depends = (arr,)
+    return img
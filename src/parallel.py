@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Parallel propagation for actanno
+
+A propagation job (objectId, first, last, box) tracks one box of an object
+from frame first to frame last. Jobs of different objects, or of disjoint
+frame segments of the same object, are independent and run in a pool of
+processes.
+
+The frames are decoded by the pool into an anonymous shared memory mapping
+created before the pool processes are forked, so that the jobs only
+exchange frame numbers and box coordinates with the main process. The
+mapping holds a window of at most `window` frames, which advances over the
+range in the order of travel: the jobs are cut at the end of the window,
+and continue in the next one from their last box. The last frame of a
+window is the first one of the next, so that the memory used does not
+depend on the length of the range. The results are returned in job order,
+whatever the order in which the jobs completed.
+
+On platforms without fork (Windows), the jobs run in the main process.
+*****************************************************************************
+"""
+
+import os
+import mmap
+import multiprocessing
+import numpy as np
+
+# State of the pool processes, set before the pool is forked
+_decode = None
+_getTracker = None
+_rectClass = None
+# the shared frames of the window: an array of shape
+# (window, height, width[, channels])
+_frames = None
+
+
+# Decode frame (index, path) into the shared frames
+def decodeJob(item):
+	index, path = item
+	img = np.asarray(_decode(path))
+	if img.shape != _frames.shape[1:]:
+		raise ValueError("frame %s has the shape %s instead of %s" % (path, img.shape, _frames.shape[1:]))
+	_frames[index] = img
+	return index
+
+
+# Run the job (jobnr, (objectId, first, last, box), slot), the frames from
+# first to last being in the shared frames from index slot on. Return
+# (jobnr, boxes) with the (framenr, box) of the frames after first, up to
+# last.
+def trackJob(item):
+	jobnr, (objectId, first, last, box), slot = item
+	tracker = _getTracker()
+	step = 1 if last >= first else -1
+	rects = [_rectClass(box[0], box[1], box[2], box[3], objectId)]
+	old = _frames[slot]
+	out = []
+	for nr in range(first+step, last+step, step):
+		slot += 1
+		new = _frames[slot]
+		if tracker == None:
+			rects = [r.copy() for r in rects]
+		else:
+			rects = tracker.trackRects(old, new, rects)
+		r = rects[0]
+		out.append((nr, (r.x1, r.y1, r.x2, r.y2)))
+		# the same array object, so that the tracker finds its data
+		old = new
+	return jobnr, out
+
+
+# Run the propagation jobs, all in the same direction, on nprocs processes.
+# paths maps the frame numbers used by the jobs to their files, decode(path)
+# returns a frame image, getTracker() the tracking engine (or None to copy
+# the boxes), and rectClass(x1, y1, x2, y2, objectId) creates a rectangle.
+# At most window frames are decoded at a time. Return the list of
+# (framenr, box) of each job.
+def runJobs(jobs, paths, decode, getTracker, rectClass, nprocs, window):
+	global _decode, _getTracker, _rectClass, _frames
+	if len(jobs) < 1:
+		return []
+	if not hasattr(os, "fork"):
+		nprocs = 1
+	steps = set([1 if last >= first else -1 for (objectId, first, last, box) in jobs])
+	if len(steps) > 1:
+		raise ValueError("the propagation jobs go in both directions")
+	window = max(window, 2)
+
+	# the frames in the order of travel, and the windows: each one starts
+	# at the last frame of the previous one
+	nrs = sorted(paths.keys(), reverse=(steps.pop() < 0))
+	windows = [nrs[i:i+window] for i in range(0, max(len(nrs)-1, 1), window-1)]
+	first = np.asarray(decode(paths[nrs[0]]))
+	shape = (min(window, len(nrs)),)+first.shape
+	buf = mmap.mmap(-1, int(np.prod(shape))*first.dtype.itemsize)
+	_decode = decode
+	_getTracker = getTracker
+	_rectClass = rectClass
+	_frames = np.frombuffer(buf, dtype=first.dtype).reshape(shape)
+	_frames[0] = first
+
+	# current frame and box of each job
+	pos = [job[1] for job in jobs]
+	boxes = [job[3] for job in jobs]
+	results = [[] for job in jobs]
+	pool = None
+	try:
+		if nprocs > 1:
+			pool = multiprocessing.Pool(nprocs)
+		for (w, nrs) in enumerate(windows):
+			if w > 0:
+				_frames[0] = _frames[len(windows[w-1])-1]
+			items = [(i, paths[nr]) for (i, nr) in enumerate(nrs)][1:]
+			slots = dict([(nr, i) for (i, nr) in enumerate(nrs)])
+			parts = []
+			for (jobnr, (objectId, start, end, box)) in enumerate(jobs):
+				p = pos[jobnr]
+				last = end if end in slots else nrs[-1]
+				if p in slots and p != last:
+					parts.append((jobnr, (objectId, p, last, boxes[jobnr]), slots[p]))
+			if pool != None:
+				pool.map(decodeJob, items)
+				done = pool.imap_unordered(trackJob, parts)
+			else:
+				map(decodeJob, items)
+				done = map(trackJob, parts)
+			for (jobnr, out) in done:
+				results[jobnr].extend(out)
+				pos[jobnr], boxes[jobnr] = out[-1]
+		if pool != None:
+			pool.close()
+			pool.join()
+			pool = None
+	finally:
+		if pool != None:
+			pool.terminate()
+		_frames = None
+		buf.close()
+	return results
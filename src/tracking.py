@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Box tracking engines for actanno
+
+A tracking engine moves the rectangles of a frame to the next frame. The
+frames are numpy arrays of shape (height, width) or (height, width,
+channels). Engines provide:
+
+  track(oldImage, newImage, rect) -> rect          one rectangle
+  trackRects(oldImage, newImage, rects) -> rects   all rectangles of a frame
+
+The returned rectangles are copies of the input ones (same class and
+objectId) with new coordinates. Coordinates are inclusive, as in the
+annotation files. The engine used by actanno is chosen with the TRACKER
+option, see actanno.getTracker.
+
+NCCTracker is a block matcher written with numpy only, used when the JM
+tracking library is not available: the box of the old frame is searched
+in a window of the new frame by normalized cross-correlation, from coarse
+to fine over an image pyramid.
+
+LKTracker follows corner features of each box with the pyramidal
+Lucas-Kanade optical flow of OpenCV (through the bundled ctypes_opencv
+package, which needs the OpenCV 1.x libraries), and moves and scales the
+box by the median motion of its features.
+
+TMTracker does the search of NCCTracker with cvMatchTemplate on OpenCV
+images, restricting the images to the box and to its search window with
+ROIs, so that its cost depends on the box size and not on the frame size.
+*****************************************************************************
+"""
+
+import numpy as np
+
+# Number of recent frames whose pyramids are kept by the engines
+PYRAMID_CACHE = 2
+
+# Half size of the Lucas-Kanade integration window
+LK_WINDOW = 7
+# Lowest number of tracked features needed to estimate the scale of a box
+LK_MIN_SCALE_FEATURES = 4
+# Limits of the change of scale of a box from one frame to the next
+LK_MAX_SCALE = 1.25
+
+
+# Grayscale float32 version of a frame array
+def toGray(img):
+	img = np.asarray(img)
+	if img.ndim == 3:
+		if img.shape[2] >= 3:
+			return (0.299*img[:, :, 0]+0.587*img[:, :, 1]+0.114*img[:, :, 2]).astype(np.float32)
+		img = img[:, :, 0]
+	return img.astype(np.float32)
+
+
+# Halve the resolution of a grayscale image by averaging 2x2 blocks
+def pyrDown(img):
+	h = img.shape[0]//2*2
+	w = img.shape[1]//2*2
+	img = img[:h, :w]
+	return 0.25*(img[0::2, 0::2]+img[1::2, 0::2]+img[0::2, 1::2]+img[1::2, 1::2])
+
+
+# Grayscale size x size patch of the content of box (x1, y1, x2, y2) in img,
+# sampled at the nearest pixels
+def boxPatch(img, box, size):
+	h, w = img.shape[:2]
+	x1, y1, x2, y2 = [int(v) for v in box[:4]]
+	xs = np.clip(np.rint(np.linspace(x1, x2, size)).astype(int), 0, w-1)
+	ys = np.clip(np.rint(np.linspace(y1, y2, size)).astype(int), 0, h-1)
+	return toGray(img[np.ix_(ys, xs)])
+
+
+# Similarity of the content of box1 in img1 and of box2 in img2, in [-1,1]:
+# normalized cross-correlation of the two boxes resampled to the same size.
+# Boxes without contrast are considered similar.
+def appearanceScore(img1, box1, img2, box2, size=16):
+	p1 = boxPatch(img1, box1, size)
+	p2 = boxPatch(img2, box2, size)
+	p1 -= p1.mean()
+	p2 -= p2.mean()
+	den = np.sqrt((p1*p1).sum()*(p2*p2).sum())
+	if den < 1e-6:
+		return 1.
+	return float((p1*p2).sum()/den)
+
+
+# Return a copy of rect moved by (dx,dy)
+def movedRect(rect, dx, dy):
+	r = rect.copy()
+	r.x1 += dx
+	r.y1 += dy
+	r.x2 += dx
+	r.y2 += dy
+	return r
+
+
+# Normalized cross-correlation of the template with all windows of its size
+# in the search image: an array of shape (sh-th+1, sw-tw+1). Windows without
+# contrast get a score of -1.
+def nccScores(template, search):
+	th, tw = template.shape
+	n = float(th*tw)
+	t = template-template.mean()
+	tnorm = np.sqrt((t*t).sum())
+	sh = search.shape[0]-th+1
+	sw = search.shape[1]-tw+1
+
+	# window sums and sums of squares from integral images
+	s = search.astype(np.float64)
+	ii = np.zeros((s.shape[0]+1, s.shape[1]+1))
+	ii[1:, 1:] = s.cumsum(0).cumsum(1)
+	ii2 = np.zeros_like(ii)
+	ii2[1:, 1:] = (s*s).cumsum(0).cumsum(1)
+	wsum = ii[th:, tw:]-ii[:sh, tw:]-ii[th:, :sw]+ii[:sh, :sw]
+	wsum2 = ii2[th:, tw:]-ii2[:sh, tw:]-ii2[th:, :sw]+ii2[:sh, :sw]
+	wvar = np.maximum(wsum2-wsum*wsum/n, 0.)
+
+	# correlation with the template, one offset at a time, so that the
+	# memory used stays at the size of the search area
+	num = np.empty((sh, sw))
+	for oy in range(sh):
+		for ox in range(sw):
+			num[oy, ox] = (s[oy:oy+th, ox:ox+tw]*t).sum()
+
+	den = tnorm*np.sqrt(wvar)
+	scores = np.empty((sh, sw))
+	flat = den < 1e-6
+	scores[flat] = -1.
+	scores[~flat] = num[~flat]/den[~flat]
+	return scores
+
+
+class NCCTracker:
+	"""Block matching by normalized cross-correlation. A box may move by
+	   up to searchRadius pixels per frame; the search starts on the image
+	   reduced levels times by 2 and is refined on each finer level."""
+
+	name = "NCC"
+
+	def __init__(self, searchRadius=16, levels=2):
+		self.searchRadius = searchRadius
+		self.levels = levels
+		# [(frame array, pyramid)] of the most recent frames
+		self.pyramids = []
+
+	# Grayscale pyramid of a frame, finest level first. The pyramids of the
+	# last frames are kept, so that propagating frame after frame builds
+	# the pyramid of each frame once.
+	def pyramid(self, img):
+		for (a, pyr) in self.pyramids:
+			if a is img:
+				return pyr
+		pyr = [toGray(img)]
+		for l in range(self.levels):
+			if min(pyr[-1].shape) < 16:
+				break
+			pyr.append(pyrDown(pyr[-1]))
+		self.pyramids = [(img, pyr)]+self.pyramids[:PYRAMID_CACHE-1]
+		return pyr
+
+	def track(self, oldImage, newImage, rect):
+		return self.trackRects(oldImage, newImage, [rect])[0]
+
+	def trackRects(self, oldImage, newImage, rects):
+		oldPyr = self.pyramid(oldImage)
+		newPyr = self.pyramid(newImage)
+		return [self.trackPyramid(oldPyr, newPyr, r) for r in rects]
+
+	# Track one rectangle over the pyramids of the two frames
+	def trackPyramid(self, oldPyr, newPyr, rect):
+		levels = min(len(oldPyr), len(newPyr))-1
+		dx = dy = 0
+		found = False
+		for l in range(levels, -1, -1):
+			if found:
+				# the offset found on the coarser level is known to +-1
+				# pixel there, that is +-2 pixels on this level
+				radius = 2
+			else:
+				radius = (self.searchRadius+(1 << l)-1) >> l
+			off = self.matchLevel(oldPyr[l], newPyr[l], rect, l, dx, dy, radius)
+			if off is not None:
+				dx, dy = off
+				found = True
+		return movedRect(rect, dx, dy)
+
+	# Search the rectangle on level l around the full resolution offset
+	# (dx,dy). Return the new full resolution offset, or None if the box
+	# is too small on this level.
+	def matchLevel(self, old, new, rect, l, dx, dy, radius):
+		h, w = old.shape
+		x1 = max(int(rect.x1) >> l, 0)
+		y1 = max(int(rect.y1) >> l, 0)
+		x2 = min(int(rect.x2) >> l, w-1)
+		y2 = min(int(rect.y2) >> l, h-1)
+		if x2-x1 < 2 or y2-y1 < 2:
+			return None
+		template = old[y1:y2+1, x1:x2+1]
+
+		# range of offsets on this level which keep the box in the new frame
+		nh, nw = new.shape
+		cx = int(round(dx/float(1 << l)))
+		cy = int(round(dy/float(1 << l)))
+		ox0 = max(cx-radius, -x1)
+		ox1 = min(cx+radius, nw-1-x2)
+		oy0 = max(cy-radius, -y1)
+		oy1 = min(cy+radius, nh-1-y2)
+		if ox1 < ox0 or oy1 < oy0:
+			return None
+		search = new[y1+oy0:y2+oy1+1, x1+ox0:x2+ox1+1]
+		scores = nccScores(template, search)
+		if scores.max() <= -1.:
+			return None
+		k = int(np.argmax(scores))
+		oy = oy0+k//scores.shape[1]
+		ox = ox0+k % scores.shape[1]
+		return (ox << l, oy << l)
+
+
+class LKTracker:
+	"""Pyramidal Lucas-Kanade tracking of up to maxFeatures corners per
+	   box. All features of a frame are tracked in one call, and the image
+	   pyramids built by OpenCV are kept for the last frames, so that each
+	   frame gets one pyramid build however many boxes are propagated.
+	   Raises ImportError if the OpenCV libraries are missing."""
+
+	name = "LK"
+
+	def __init__(self, maxFeatures=40, levels=2):
+		import ctypes_opencv
+		self.cv = ctypes_opencv
+		self.maxFeatures = maxFeatures
+		self.levels = levels
+		# [(frame array, frame data)] of the most recent frames, the frame
+		# data being a list [gray array, gray image, pyramid image, pyramid
+		# ready]
+		self.frames = []
+
+	# The grayscale image and the pyramid buffer of a frame
+	def frameData(self, img):
+		for (a, data) in self.frames:
+			if a is img:
+				return data
+		cv = self.cv
+		gray = np.ascontiguousarray(np.clip(toGray(img), 0, 255).astype(np.uint8))
+		h, w = gray.shape
+		# size of the pyramid buffer required by cvCalcOpticalFlowPyrLK
+		pyr = cv.cvCreateImage(cv.cvSize(w+8, h//3), cv.IPL_DEPTH_8U, 1)
+		data = [gray, cv.cvCreateImageFromNumpyArray(gray), pyr, False]
+		self.frames = [(img, data)]+self.frames[:PYRAMID_CACHE-1]
+		return data
+
+	# Corner features of the image inside the rectangle, as an (n,2) array
+	def features(self, image, rect):
+		cv = self.cv
+		x1 = max(int(rect.x1), 0)
+		y1 = max(int(rect.y1), 0)
+		x2 = min(int(rect.x2), image.width-1)
+		y2 = min(int(rect.y2), image.height-1)
+		if x2-x1 < 4 or y2-y1 < 4:
+			return np.zeros((0, 2))
+		w = x2-x1+1
+		h = y2-y1+1
+		cv.cvSetImageROI(image, cv.cvRect(x1, y1, w, h))
+		eig = cv.cvCreateMat(h, w, cv.CV_32FC1)
+		temp = cv.cvCreateMat(h, w, cv.CV_32FC1)
+		corners = cv.cvGoodFeaturesToTrack(image, eig, temp, None, self.maxFeatures, 0.01, 3)
+		cv.cvResetImageROI(image)
+		return np.array([(p.x+x1, p.y+y1) for p in corners]).reshape(-1, 2)
+
+	def track(self, oldImage, newImage, rect):
+		return self.trackRects(oldImage, newImage, [rect])[0]
+
+	def trackRects(self, oldImage, newImage, rects):
+		cv = self.cv
+		old = self.frameData(oldImage)
+		new = self.frameData(newImage)
+
+		feats = [self.features(old[1], r) for r in rects]
+		counts = [len(f) for f in feats]
+		n = sum(counts)
+		if n < 1:
+			return [r.copy() for r in rects]
+		allFeats = np.concatenate(feats)
+		prevFeatures = (cv.CvPoint2D32f*n)(*[cv.CvPoint2D32f(x, y) for (x, y) in allFeats])
+		flags = 0
+		if old[3]:
+			flags |= cv.CV_LKFLOW_PYR_A_READY
+		if new[3]:
+			flags |= cv.CV_LKFLOW_PYR_B_READY
+		criteria = cv.cvTermCriteria(cv.CV_TERMCRIT_ITER+cv.CV_TERMCRIT_EPS, 20, 0.03)
+		currFeatures, status = cv.cvCalcOpticalFlowPyrLK(old[1], new[1], old[2], new[2],
+			prevFeatures, None, n, cv.cvSize(LK_WINDOW, LK_WINDOW), self.levels,
+			None, None, criteria, flags)
+		old[3] = new[3] = True
+
+		moved = np.array([(p.x, p.y) for p in currFeatures]).reshape(-1, 2)
+		ok = np.array([s != "\0" for s in status], dtype=bool)
+		out = []
+		start = 0
+		for (r, count) in zip(rects, counts):
+			sel = ok[start:start+count]
+			out.append(medianMotion(r, allFeats[start:start+count][sel], moved[start:start+count][sel]))
+			start += count
+		return out
+
+
+# Move and scale a rectangle by the median motion of its features, given as
+# (n,2) arrays of the positions in the old and in the new frame
+def medianMotion(rect, p0, p1):
+	if len(p0) < 1:
+		return rect.copy()
+	dx, dy = np.median(p1-p0, axis=0)
+	scale = 1.
+	if len(p0) >= LK_MIN_SCALE_FEATURES:
+		# ratio of the distances of all pairs of features
+		i, j = np.triu_indices(len(p0), 1)
+		d0 = np.sqrt(((p0[i]-p0[j])**2).sum(1))
+		d1 = np.sqrt(((p1[i]-p1[j])**2).sum(1))
+		valid = d0 > 1.
+		if valid.any():
+			scale = float(np.clip(np.median(d1[valid]/d0[valid]), 1./LK_MAX_SCALE, LK_MAX_SCALE))
+	cx = 0.5*(rect.x1+rect.x2)+dx
+	cy = 0.5*(rect.y1+rect.y2)+dy
+	hw = 0.5*(rect.x2-rect.x1)*scale
+	hh = 0.5*(rect.y2-rect.y1)*scale
+	r = rect.copy()
+	r.x1 = int(round(cx-hw))
+	r.y1 = int(round(cy-hh))
+	r.x2 = int(round(cx+hw))
+	r.y2 = int(round(cy+hh))
+	return r
+
+
+class TMTracker(NCCTracker):
+	"""The coarse to fine search of NCCTracker done by cvMatchTemplate
+	   (normalized correlation coefficient), on pyramids made by cvPyrDown.
+	   Raises ImportError if the OpenCV libraries are missing."""
+
+	name = "TM"
+
+	def __init__(self, searchRadius=16, levels=1):
+		import ctypes_opencv
+		self.cv = ctypes_opencv
+		NCCTracker.__init__(self, searchRadius, levels)
+
+	# Grayscale pyramid of a frame as OpenCV images, finest level first
+	def pyramid(self, img):
+		for (a, pyr) in self.pyramids:
+			if a is img:
+				return pyr
+		cv = self.cv
+		gray = np.ascontiguousarray(np.clip(toGray(img), 0, 255).astype(np.uint8))
+		pyr = [cv.cvCreateImageFromNumpyArray(gray)]
+		for l in range(self.levels):
+			prev = pyr[-1]
+			if min(prev.width, prev.height) < 16:
+				break
+			down = cv.cvCreateImage(cv.cvSize((prev.width+1)//2, (prev.height+1)//2), cv.IPL_DEPTH_8U, 1)
+			cv.cvPyrDown(prev, down)
+			pyr.append(down)
+		self.pyramids = [(img, pyr)]+self.pyramids[:PYRAMID_CACHE-1]
+		return pyr
+
+	# See NCCTracker.matchLevel
+	def matchLevel(self, old, new, rect, l, dx, dy, radius):
+		cv = self.cv
+		x1 = max(int(rect.x1) >> l, 0)
+		y1 = max(int(rect.y1) >> l, 0)
+		x2 = min(int(rect.x2) >> l, old.width-1)
+		y2 = min(int(rect.y2) >> l, old.height-1)
+		if x2-x1 < 2 or y2-y1 < 2:
+			return None
+
+		cx = int(round(dx/float(1 << l)))
+		cy = int(round(dy/float(1 << l)))
+		ox0 = max(cx-radius, -x1)
+		ox1 = min(cx+radius, new.width-1-x2)
+		oy0 = max(cy-radius, -y1)
+		oy1 = min(cy+radius, new.height-1-y2)
+		if ox1 < ox0 or oy1 < oy0:
+			return None
+
+		cv.cvSetImageROI(old, cv.cvRect(x1, y1, x2-x1+1, y2-y1+1))
+		cv.cvSetImageROI(new, cv.cvRect(x1+ox0, y1+oy0, x2-x1+1+ox1-ox0, y2-y1+1+oy1-oy0))
+		result = cv.cvCreateMat(oy1-oy0+1, ox1-ox0+1, cv.CV_32FC1)
+		cv.cvMatchTemplate(new, old, result, cv.CV_TM_CCOEFF_NORMED)
+		cv.cvResetImageROI(old)
+		cv.cvResetImageROI(new)
+		maxVal, maxLoc = cv.cvMinMaxLoc(result, None, True, None, True)
+		return ((ox0+maxLoc.x) << l, (oy0+maxLoc.y) << l)
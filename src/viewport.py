@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+*****************************************************************************
+Zoom and pan viewport for actanno
+
+The viewport shows a part of the frame on a canvas of fixed size, at a
+zoom factor (canvas pixels per frame pixel). Its origin is the position of
+the canvas corner in the zoomed frame, in whole canvas pixels, so that the
+image and the rectangles drawn over it are always aligned.
+
+The zoomed frame is cut into square tiles of TILE_SIZE canvas pixels. A
+view only renders the tiles it shows: each one is cropped from the source
+image and resized, and kept in an LRU cache keyed by the source and the
+zoom, so that panning and going back to a zoom level only renders the new
+tiles. The work per view depends on the canvas size, not on the
+size of the source frame.
+*****************************************************************************
+"""
+
+import math
+from collections import OrderedDict
+from PIL import Image
+
+# Size of the tiles, in canvas pixels
+TILE_SIZE = 256
+
+
+class Viewport:
+	"""A view of width x height canvas pixels on a frame. zoom is in canvas
+	   pixels per frame pixel, between minZoom (the whole frame fits the
+	   canvas) and maxZoom. maxTiles is the size of the tile cache."""
+
+	def __init__(self, width, height, minZoom, maxZoom, maxTiles):
+		self.tiles = OrderedDict()
+		self.maxTiles = maxTiles
+		self.maxZoom = maxZoom
+		self.reset(width, height, minZoom)
+
+	# Show the whole frame again, on a canvas of the given size
+	def reset(self, width, height, minZoom):
+		self.width = width
+		self.height = height
+		self.minZoom = minZoom
+		self.zoom = minZoom
+		# origin of the canvas in the zoomed frame, in canvas pixels
+		self.ux = 0
+		self.uy = 0
+
+	def zoomed(self):
+		return self.zoom > self.minZoom
+
+	# Convert a position on the canvas to frame coordinates
+	def toImage(self, x, y):
+		return (int(round((x+self.ux)/self.zoom)), int(round((y+self.uy)/self.zoom)))
+
+	# Convert frame coordinates x1, y1, x2, y2, ... to canvas coordinates
+	def toCanvas(self, *coords):
+		z = self.zoom
+		return [c*z-(self.uy if k % 2 else self.ux) for (k, c) in enumerate(coords)]
+
+	# Multiply the zoom by factor, keeping the frame point under the canvas
+	# position x,y in place
+	def zoomAt(self, factor, x, y):
+		zoom = min(max(self.zoom*factor, self.minZoom), self.maxZoom)
+		fx = (x+self.ux)/self.zoom
+		fy = (y+self.uy)/self.zoom
+		self.zoom = zoom
+		self.ux = int(round(fx*zoom-x))
+		self.uy = int(round(fy*zoom-y))
+		self.clamp()
+
+	# Move the view by dx,dy canvas pixels
+	def pan(self, dx, dy):
+		self.ux -= int(round(dx))
+		self.uy -= int(round(dy))
+		self.clamp()
+
+	# Keep the view inside the zoomed frame
+	def clamp(self):
+		w = int(math.ceil(self.width*self.zoom/self.minZoom))
+		h = int(math.ceil(self.height*self.zoom/self.minZoom))
+		self.ux = min(max(self.ux, 0), max(w-self.width, 0))
+		self.uy = min(max(self.uy, 0), max(h-self.height, 0))
+
+	# Return the canvas image of the view. img is the source image, with
+	# scale source pixels per frame pixel, and key identifies its content
+	# for the tile cache.
+	def render(self, img, key, scale):
+		if not self.zoomed():
+			return img
+		z = self.zoom
+		T = TILE_SIZE
+		# size of the zoomed frame
+		zw = int(round(img.size[0]*z/scale))
+		zh = int(round(img.size[1]*z/scale))
+		out = Image.new(img.mode, (self.width, self.height))
+		for j in range(self.uy // T, min(self.uy+self.height-1, zh-1) // T + 1):
+			for i in range(self.ux // T, min(self.ux+self.width-1, zw-1) // T + 1):
+				out.paste(self.tile(img, key, scale, zw, zh, i, j), (i*T-self.ux, j*T-self.uy))
+		return out
+
+	# The tile i,j of the zoomed frame of size zw x zh, from the cache or
+	# cropped and resized from the source image
+	def tile(self, img, key, scale, zw, zh, i, j):
+		tkey = (key, self.zoom, i, j)
+		t = self.tiles.pop(tkey, None)
+		if t is None:
+			T = TILE_SIZE
+			x0, y0 = i*T, j*T
+			x1, y1 = min(x0+T, zw), min(y0+T, zh)
+			# the source pixels around the tile area, resized to the zoom
+			# and cropped to the tile (resize has no source box before
+			# Pillow 4.3)
+			f = scale/self.zoom
+			sx0, sy0 = int(math.floor(x0*f)), int(math.floor(y0*f))
+			sx1 = min(int(math.ceil(x1*f)), img.size[0])
+			sy1 = min(int(math.ceil(y1*f)), img.size[1])
+			ox, oy = int(round(x0-sx0/f)), int(round(y0-sy0/f))
+			w = max(int(round((sx1-sx0)/f)), ox+x1-x0)
+			h = max(int(round((sy1-sy0)/f)), oy+y1-y0)
+			t = img.crop((sx0, sy0, sx1, sy1)).resize((w, h), Image.BILINEAR)
+			t = t.crop((ox, oy, ox+x1-x0, oy+y1-y0))
+			while len(self.tiles) >= self.maxTiles:
+				self.tiles.popitem(last=False)
+		self.tiles[tkey] = t
+		return t